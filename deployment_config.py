@@ -1,6 +1,64 @@
 import os
 import tempfile
 from pathlib import Path
+from typing import Optional, Tuple
+
+def _ensure_dir(path: str) -> str:
+    """Create a directory if it does not exist yet and return its path"""
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def resolve_base_dirs(deployment_mode: Optional[str] = None, storage_type: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Resolve the root temporary and output directories for a deployment
+    
+    Args:
+        deployment_mode: 'development' or 'production' (default: DEPLOYMENT_MODE environment variable)
+        storage_type: 'local', 'shared' or 'cloud' (default: STORAGE_TYPE environment variable)
+        
+    Returns:
+        Tuple of (temporary root, output root); nothing is created. Not cached, since the
+        result depends on the environment and the working directory at call time
+    """
+    if deployment_mode is None:
+        deployment_mode = os.environ.get('DEPLOYMENT_MODE', 'development')
+    if storage_type is None:
+        storage_type = os.environ.get('STORAGE_TYPE', 'local')
+    
+    if deployment_mode == 'production':
+        if storage_type == 'shared':
+            # Shared network storage
+            return (os.path.join("/shared/uploads", "hexagon_detection"),
+                    os.path.join("/shared/results", "hexagon_output"))
+        # Local server storage (also the default for other storage types)
+        return (os.path.join(tempfile.gettempdir(), "hexagon_detection"),
+                os.path.join(tempfile.gettempdir(), "hexagon_output"))
+    
+    # Development mode
+    return os.path.join(os.getcwd(), "temp-directory"), "output"
+
+def resolve_dirs(session_id: str, image_name: str, deployment_mode: Optional[str] = None,
+                 storage_type: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Resolve the temporary and output directories for a session and image
+    
+    Args:
+        session_id: Session the directories belong to
+        image_name: Name of the image whose results go in the output directory
+        deployment_mode: 'development' or 'production' (default: DEPLOYMENT_MODE environment variable)
+        storage_type: 'local', 'shared' or 'cloud' (default: STORAGE_TYPE environment variable)
+        
+    Returns:
+        Tuple of (temporary directory, output directory); nothing is created
+    """
+    if deployment_mode is None:
+        deployment_mode = os.environ.get('DEPLOYMENT_MODE', 'development')
+    
+    temp_root, output_root = resolve_base_dirs(deployment_mode, storage_type)
+    if deployment_mode == 'production':
+        return os.path.join(temp_root, session_id), os.path.join(output_root, session_id, image_name)
+    # Development mode keeps outputs per image in the project folder
+    return os.path.join(temp_root, session_id), os.path.join(output_root, image_name)
 
 class DeploymentConfig:
     """
@@ -13,46 +71,19 @@ class DeploymentConfig:
         
     def get_temp_directory(self, session_id: str) -> str:
         """Get temporary directory for processing"""
-        if self.deployment_mode == 'production':
-            if self.storage_type == 'local':
-                # Local server storage
-                temp_dir = os.path.join(tempfile.gettempdir(), "hexagon_detection", session_id)
-            elif self.storage_type == 'shared':
-                # Shared network storage
-                temp_dir = os.path.join("/shared/uploads", "hexagon_detection", session_id)
-            else:
-                # Default to system temp
-                temp_dir = os.path.join(tempfile.gettempdir(), "hexagon_detection", session_id)
-        else:
-            # Development mode
-            temp_dir = os.path.join(os.getcwd(), "temp-directory", session_id)
-        
-        os.makedirs(temp_dir, exist_ok=True)
-        return temp_dir
+        temp_dir, _ = resolve_dirs(session_id, "", self.deployment_mode, self.storage_type)
+        return _ensure_dir(temp_dir)
     
     def get_output_directory(self, session_id: str, image_name: str) -> str:
         """Get output directory for results"""
-        if self.deployment_mode == 'production':
-            if self.storage_type == 'local':
-                # Local server storage
-                output_dir = os.path.join(tempfile.gettempdir(), "hexagon_output", session_id, image_name)
-            elif self.storage_type == 'shared':
-                # Shared network storage
-                output_dir = os.path.join("/shared/results", "hexagon_output", session_id, image_name)
-            else:
-                # Default to system temp
-                output_dir = os.path.join(tempfile.gettempdir(), "hexagon_output", session_id, image_name)
-        else:
-            # Development mode
-            output_dir = os.path.join("output", image_name)
-        
-        os.makedirs(output_dir, exist_ok=True)
-        return output_dir
+        _, output_dir = resolve_dirs(session_id, image_name, self.deployment_mode, self.storage_type)
+        return _ensure_dir(output_dir)
     
     def cleanup_old_files(self, max_age_hours: int = 24):
         """Clean up old temporary files"""
         import time
         import shutil
+        import stat
         
         current_time = time.time()
         max_age_seconds = max_age_hours * 3600
@@ -64,17 +95,18 @@ class DeploymentConfig:
         ]
         
         for temp_dir in temp_dirs:
-            if os.path.exists(temp_dir):
-                for item in os.listdir(temp_dir):
-                    item_path = os.path.join(temp_dir, item)
-                    if os.path.isdir(item_path):
-                        # Check if directory is old
-                        if current_time - os.path.getctime(item_path) > max_age_seconds:
-                            try:
-                                shutil.rmtree(item_path)
-                                print(f"Cleaned up old directory: {item_path}")
-                            except Exception as e:
-                                print(f"Failed to clean up {item_path}: {e}")
+            if not os.path.exists(temp_dir):
+                continue
+            with os.scandir(temp_dir) as entries:
+                for entry in entries:
+                    # One stat per entry covers both the directory and age checks
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    if stat.S_ISDIR(st.st_mode) and current_time - st.st_ctime > max_age_seconds:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        print(f"Cleaned up old directory: {entry.path}")
 
 # Global configuration instance
 config = DeploymentConfig()
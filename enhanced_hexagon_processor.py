@@ -1,35 +1,77 @@
-import json
+import orjson
 import argparse
+import functools
 import os
-from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 import re
+import sys
 from collections import defaultdict
 
+HEXAGON_NUMBER_PATTERN = re.compile(r'hexagon_(\d+)')
+
+# Values used for fields missing from a true hexagon record
+HEXAGON_FIELD_DEFAULTS = {'image_file': '', 'upper_line': '', 'lower_line': '', 'confidence': 'N/A'}
+
+# Image formats accepted for the original image
+IMAGE_FORMATS = ['JPEG', 'PNG', 'BMP', 'TIFF', 'GIF', 'WEBP']
+
 def extract_hexagon_number(filename):
     """
     Extract hexagon number from filename like 'hexagon_001_conf_100%.png'
     """
-    match = re.search(r'hexagon_(\d+)', filename)
+    # Fast path for the names written by extract_hexagons.py
+    _, sep, rest = filename.partition('hexagon_')
+    if sep:
+        number = rest.split('_', 1)[0].split('.', 1)[0]
+        if number.isdecimal():
+            return int(number)
+    
+    match = HEXAGON_NUMBER_PATTERN.search(filename)
     if match:
         return int(match.group(1))
     return None
 
+@functools.lru_cache(maxsize=8)
+def get_label_font(name="arial.ttf", size=16):
+    """
+    Load the label font once and reuse it, falling back to Pillow's default font
+    """
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        try:
+            return ImageFont.load_default()
+        except Exception:
+            return None
+
+def group_hexagons_by_text(true_hexagons):
+    """
+    Group hexagons by their "upper/lower" text label in a single pass
+    
+    Grouping on the label itself (rather than the (upper, lower) pair) means texts that
+    produce the same label, such as "a/b" + "c" and "a" + "b/c", share one group and count
+    instead of overwriting each other when the keys are written out.
+    """
+    hexagon_counts = defaultdict(list)
+    
+    for hexagon in true_hexagons:
+        upper = hexagon.get('upper_line', '')
+        lower = hexagon.get('lower_line', '')
+        hexagon_counts[f"{upper}/{lower}"].append(hexagon)
+    
+    return hexagon_counts
+
 def count_duplicate_hexagons(true_hexagons_json_path):
     """
     Count duplicate hexagons with the same upper and lower lines
     """
     try:
-        with open(true_hexagons_json_path, 'r', encoding='utf-8') as f:
-            true_hexagons = json.load(f)
+        with open(true_hexagons_json_path, 'rb') as f:
+            true_hexagons = orjson.loads(f.read())
         
         # Create a dictionary to count duplicates
-        hexagon_counts = defaultdict(list)
-        
-        for hexagon in true_hexagons:
-            upper = hexagon.get('upper_line', '')
-            lower = hexagon.get('lower_line', '')
-            key = f"{upper}/{lower}"
-            hexagon_counts[key].append(hexagon)
+        hexagon_counts = group_hexagons_by_text(true_hexagons)
         
         # Find duplicates
         duplicates = {}
@@ -46,165 +88,187 @@ def count_duplicate_hexagons(true_hexagons_json_path):
         print(f"Error counting duplicates: {str(e)}")
         return {}
 
-def map_true_hexagons_to_image(original_image_path, true_hexagons_json_path, output_image_path, detection_json_path=None):
+def map_true_hexagons_to_image(original_image_path, true_hexagons_json_path, output_image_path, detection_json_path=None,
+                               max_output_size=None, extraction_threshold=0.70, true_hexagons=None, detection_data=None):
     """
     Map only true hexagons back to the original image and highlight them in green
+    
+    If max_output_size is given, the saved image is downscaled so neither side exceeds it.
+    extraction_threshold must match the threshold extract_hexagons.py used to number the crops.
+    true_hexagons and detection_data can be passed in directly to skip reading their JSON files.
+    
+    Returns the instance analysis that is also saved next to the image, or False on failure.
     """
     try:
         # Load the original image
         print(f"Loading original image: {original_image_path}")
-        original_image = Image.open(original_image_path)
+        # Only probe the formats the pipeline accepts; Pillow reads just the header here
+        # and defers the pixel decode until the image is drawn on
+        original_image = Image.open(original_image_path, formats=IMAGE_FORMATS)
+        # Convert palette/RGBA/grayscale inputs once up front so drawing and the JPEG save
+        # work on RGB directly; RGB inputs are annotated in place since nothing reuses them
+        if original_image.mode != 'RGB':
+            original_image = original_image.convert('RGB')
         original_width, original_height = original_image.size
         print(f"Original image size: {original_width}x{original_height}")
         
         # Load the true hexagons JSON
-        print(f"Loading true hexagons data: {true_hexagons_json_path}")
-        with open(true_hexagons_json_path, 'r', encoding='utf-8') as f:
-            true_hexagons = json.load(f)
+        if true_hexagons is None:
+            print(f"Loading true hexagons data: {true_hexagons_json_path}")
+            with open(true_hexagons_json_path, 'rb') as f:
+                true_hexagons = orjson.loads(f.read())
         
         print(f"Found {len(true_hexagons)} true hexagons to map")
         
-        # Count all instances (including unique ones)
-        hexagon_counts = defaultdict(list)
+        # Fill in missing fields once so the loops below can index directly; the copies leave
+        # the caller's hexagon dicts (which the app caches and serializes) untouched
+        true_hexagons = [{**HEXAGON_FIELD_DEFAULTS, **hexagon} for hexagon in true_hexagons]
         
-        for hexagon in true_hexagons:
-            upper = hexagon.get('upper_line', '')
-            lower = hexagon.get('lower_line', '')
-            key = f"{upper}/{lower}"
-            hexagon_counts[key].append(hexagon)
+        # Count all instances (including unique ones); duplicates are the groups with more than one
+        hexagon_counts = group_hexagons_by_text(true_hexagons)
         
-        # Create all_instances dictionary (including unique ones)
-        all_instances = {}
-        duplicates = {}
+        # Collect report lines and write them in one go instead of printing per hexagon
+        lines = []
+        if any(len(hexagons) > 1 for hexagons in hexagon_counts.values()):
+            lines.append(f"\nDuplicate Hexagons Found:")
+            lines.append("-" * 40)
+            for key, hexagons in hexagon_counts.items():
+                if len(hexagons) > 1:
+                    lines.append(f"• {key}: {len(hexagons)} instances")
+                    for hexagon in hexagons:
+                        lines.append(f"  - {hexagon['image_file'] or 'Unknown'} (confidence: {hexagon['confidence']})")
         
+        lines.append(f"\nAll Instances Found:")
+        lines.append("-" * 40)
         for key, hexagons in hexagon_counts.items():
-            count = len(hexagons)
-            all_instances[key] = {
-                'count': count,
-                'hexagons': hexagons
-            }
-            # Also store duplicates separately
-            if count > 1:
-                duplicates[key] = {
-                    'count': count,
-                    'hexagons': hexagons
-                }
-        
-        if duplicates:
-            print(f"\nDuplicate Hexagons Found:")
-            print("-" * 40)
-            for key, info in duplicates.items():
-                print(f"• {key}: {info['count']} instances")
-                for hexagon in info['hexagons']:
-                    print(f"  - {hexagon.get('image_file', 'Unknown')} (confidence: {hexagon.get('confidence', 'N/A')})")
-        
-        print(f"\nAll Instances Found:")
-        print("-" * 40)
-        for key, info in all_instances.items():
-            print(f"• {key}: {info['count']} instance{'s' if info['count'] > 1 else ''}")
+            lines.append(f"• {key}: {len(hexagons)} instance{'s' if len(hexagons) > 1 else ''}")
         
         # Load detection results if available
-        detections = {}
-        if detection_json_path and os.path.exists(detection_json_path):
-            with open(detection_json_path, 'r') as f:
-                detection_data = json.load(f)
-                # Parse detection data into hexagon number mapping
-                predictions = detection_data.get('predictions', {}).get('predictions', [])
-                for i, detection in enumerate(predictions, 1):
-                    detections[i] = detection.get('boundingBox', {})
+        detection_boxes = []
+        if detection_data is None and detection_json_path and os.path.exists(detection_json_path):
+            with open(detection_json_path, 'rb') as f:
+                detection_data = orjson.loads(f.read())
         
-        # Create a copy of the original image for annotation
-        annotated_image = original_image.copy()
+        if detection_data:
+            # extract_hexagons.py numbers crops by their position among predictions at or above
+            # its confidence threshold, so apply the same filter before numbering
+            predictions = detection_data.get('predictions', {}).get('predictions', [])
+            predictions = [p for p in predictions if p.get('probability', 0) >= extraction_threshold]
+            
+            if predictions:
+                # Convert all normalized boxes to pixel corners at once: hexagon #n is row n-1
+                boxes = np.array([
+                    [bbox.get('left', 0), bbox.get('top', 0), bbox.get('width', 0), bbox.get('height', 0)]
+                    for bbox in (p.get('boundingBox', {}) for p in predictions)
+                ], dtype=np.float64)
+                boxes[:, 2:] += boxes[:, :2]
+                boxes *= np.array([original_width, original_height, original_width, original_height], dtype=np.float64)
+                detection_boxes = boxes.astype(np.int64).tolist()
+        
+        annotated_image = original_image
         draw = ImageDraw.Draw(annotated_image)
         
-        # Try to load a font for text annotation
-        try:
-            font = ImageFont.truetype("arial.ttf", 16)
-        except:
-            try:
-                font = ImageFont.load_default()
-            except:
-                font = None
+        # Font for text annotation (loaded once per process)
+        font = get_label_font()
         
-        # Process each true hexagon
+        # Process each true hexagon, collecting the shapes to draw
         mapped_count = 0
+        rects = []
+        labels = []
+        num_detections = len(detection_boxes)
+        get_number = extract_hexagon_number
+        add_rect = rects.append
+        add_label = labels.append
+        add_line = lines.append
         for hexagon_data in true_hexagons:
-            image_file = hexagon_data.get('image_file', '')
-            hexagon_number = extract_hexagon_number(image_file)
+            image_file = hexagon_data['image_file']
+            hexagon_number = get_number(image_file)
             
             if hexagon_number is None:
-                print(f"Could not extract hexagon number from: {image_file}")
+                add_line(f"Could not extract hexagon number from: {image_file}")
                 continue
             
             # Get detection coordinates
-            if hexagon_number in detections:
-                bbox = detections[hexagon_number]
+            if 1 <= hexagon_number <= num_detections:
+                x1, y1, x2, y2 = detection_boxes[hexagon_number - 1]
             else:
                 # Use simplified positioning if no detection data available
-                print(f"No detection data for hexagon #{hexagon_number}, using simplified positioning")
-                bbox = {
-                    'left': 0.1 + (hexagon_number * 0.05) % 0.8,
-                    'top': 0.1 + (hexagon_number * 0.03) % 0.8,
-                    'width': 0.04,
-                    'height': 0.04
-                }
-            
-            # Extract bounding box coordinates
-            left = bbox.get('left', 0)
-            top = bbox.get('top', 0)
-            width = bbox.get('width', 0)
-            height = bbox.get('height', 0)
+                add_line(f"No detection data for hexagon #{hexagon_number}, using simplified positioning")
+                left = 0.1 + (hexagon_number * 0.05) % 0.8
+                top = 0.1 + (hexagon_number * 0.03) % 0.8
+                width = 0.04
+                height = 0.04
+                
+                # Convert normalized coordinates to pixel coordinates
+                x1 = int(left * original_width)
+                y1 = int(top * original_height)
+                x2 = int((left + width) * original_width)
+                y2 = int((top + height) * original_height)
             
-            # Convert normalized coordinates to pixel coordinates
-            x1 = int(left * original_width)
-            y1 = int(top * original_height)
-            x2 = int((left + width) * original_width)
-            y2 = int((top + height) * original_height)
-            
-            # Draw green rectangle around the hexagon
-            draw.rectangle([x1, y1, x2, y2], outline='green', width=3)
+            # Queue green rectangle around the hexagon
+            add_rect((x1, y1, x2, y2))
             
             # Add text annotation
-            upper_text = hexagon_data.get('upper_line', '')
-            lower_text = hexagon_data.get('lower_line', '')
-            confidence = hexagon_data.get('confidence', 'N/A')
+            upper_text = hexagon_data['upper_line']
+            lower_text = hexagon_data['lower_line']
             
             # Create label text
             label_text = f"#{hexagon_number}"
             if upper_text or lower_text:
                 label_text += f" ({upper_text}/{lower_text})"
+            add_label((x1, y1, label_text))
             
+            mapped_count += 1
+            add_line(f"Mapped hexagon #{hexagon_number}: {upper_text}/{lower_text}")
+        
+        sys.stdout.write("\n".join(lines) + "\n")
+        
+        # Draw all boxes first, then all labels, so labels are never covered by a later box
+        green = ImageColor.getrgb('green')
+        white = ImageColor.getrgb('white')
+        draw_rectangle = draw.rectangle
+        draw_text = draw.text
+        for rect in rects:
+            draw_rectangle(rect, outline=green, width=3)
+        
+        for x1, y1, label_text in labels:
             # Draw text background
             if font:
                 text_bbox = draw.textbbox((x1, y1 - 20), label_text, font=font)
-                draw.rectangle(text_bbox, fill='green', outline='white')
-                draw.text((x1, y1 - 20), label_text, fill='white', font=font)
+                draw_rectangle(text_bbox, fill=green, outline=white)
+                draw_text((x1, y1 - 20), label_text, fill=white, font=font)
             else:
                 # Simple text without font
-                draw.text((x1, y1 - 15), label_text, fill='green')
-            
-            mapped_count += 1
-            print(f"Mapped hexagon #{hexagon_number}: {upper_text}/{lower_text}")
+                draw_text((x1, y1 - 15), label_text, fill=green)
         
-        # Save the annotated image
-        annotated_image.save(output_image_path, 'JPEG', quality=95)
+        # Save the annotated image; a preview-sized copy is enough when requested
+        if max_output_size:
+            annotated_image.thumbnail((max_output_size, max_output_size), Image.Resampling.BILINEAR)
+        annotated_image.save(output_image_path, 'JPEG', quality=85, optimize=False, progressive=False, subsampling=2)
         
         print(f"\nSuccessfully mapped {mapped_count} true hexagons!")
         print(f"Annotated image saved to: {output_image_path}")
         
+        # Same schema as count_duplicate_hexagons: every group carries its count and hexagons
+        all_instances = {key: {'count': len(hexagons), 'hexagons': hexagons}
+                         for key, hexagons in hexagon_counts.items()}
+        duplicates = {key: info for key, info in all_instances.items() if info['count'] > 1}
+        
+        analysis = {
+            'total_hexagons': len(true_hexagons),
+            'unique_combinations': len(hexagon_counts),
+            'all_instances': all_instances,
+            'duplicates': duplicates,
+            'summary': {key: info['count'] for key, info in all_instances.items()}
+        }
+        
         # Save duplicate analysis to JSON
         duplicate_analysis_path = output_image_path.replace('.jpg', '_duplicate_analysis.json')
-        with open(duplicate_analysis_path, 'w', encoding='utf-8') as f:
-            json.dump({
-                'total_hexagons': len(true_hexagons),
-                'unique_combinations': len(set(f"{h.get('upper_line', '')}/{h.get('lower_line', '')}" for h in true_hexagons)),
-                'all_instances': all_instances,
-                'duplicates': duplicates,
-                'summary': {key: info['count'] for key, info in all_instances.items()}
-            }, f, indent=2, ensure_ascii=False)
+        with open(duplicate_analysis_path, 'wb') as f:
+            f.write(orjson.dumps(analysis, option=orjson.OPT_INDENT_2))
         print(f"Instance analysis saved to: {duplicate_analysis_path}")
         
-        return True
+        return analysis
         
     except Exception as e:
         print(f"Error mapping hexagons: {str(e)}")
@@ -219,6 +283,8 @@ def main():
     parser.add_argument('true_hexagons_json', help='Path to the JSON file with only true hexagons')
     parser.add_argument('--output', '-o', help='Output image path (optional)')
     parser.add_argument('--detection-json', '-d', help='Path to detection results JSON (optional)')
+    parser.add_argument('--threshold', '-t', type=float, default=0.70, help='Confidence threshold used when extracting the hexagons (default: 0.70)')
+    parser.add_argument('--max-size', type=int, help='Downscale the saved image so neither side exceeds this many pixels (optional)')
     
     args = parser.parse_args()
     
@@ -253,7 +319,9 @@ def main():
         args.original_image, 
         args.true_hexagons_json, 
         output_path,
-        args.detection_json
+        args.detection_json,
+        args.max_size,
+        args.threshold
     )
     
     if success:
@@ -1,16 +1,81 @@
 import os
-import json
+import contextlib
+import functools
+import threading
+from collections import OrderedDict, deque
+import hashlib
+import io
+import multiprocessing
+import tempfile
+import time
+import numpy as np
+import orjson
 import requests
+import sys
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageFilter
 import argparse
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Pillow save arguments for each supported crop format; PNG stays lossless, JPEG and
+# WebP encode much faster and smaller when exact pixels aren't needed
+CROP_FORMATS = {
+    'png': ('.png', 'PNG', {'compress_level': 1}),
+    'jpeg': ('.jpg', 'JPEG', {'quality': 92, 'subsampling': 0}),
+    'webp': ('.webp', 'WEBP', {'quality': 90, 'method': 0}),
+}
+
+# Supported input image formats (a tuple so str.endswith can test them all in one C call)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
+
+# Write buffer for crop files, so each crop reaches the OS in a few large writes
+CROP_WRITE_BUFFER_SIZE = 1 << 20
+
+def iter_images_in_directory(input_dir: str):
+    """
+    Yield the paths of supported image files in a directory
+    
+    Args:
+        input_dir: Directory to search for images
+    """
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                yield entry.path
+
+def save_hexagon_crop(image: Image.Image, crop_box, hexagon_path: str, pil_format: str, save_options: Dict[str, Any]):
+    """
+    Crop one hexagon from a loaded image and encode it straight to disk
+    
+    Args:
+        image: Decoded source image (shared read-only between threads)
+        crop_box: Pixel box (left, top, right, bottom) to extract
+        hexagon_path: Output file path
+        pil_format: Pillow format name to save as
+        save_options: Encoder options for that format
+    """
+    hexagon_crop = image.crop(crop_box)
+    
+    # JPEG has no alpha or palette support
+    if pil_format == 'JPEG' and hexagon_crop.mode not in ('RGB', 'L'):
+        hexagon_crop = hexagon_crop.convert('RGB')
+    
+    with open(hexagon_path, 'wb', buffering=CROP_WRITE_BUFFER_SIZE) as fp:
+        hexagon_crop.save(fp, pil_format, **save_options)
+
+# Number of prediction results kept in memory per extractor
+MEMORY_CACHE_SIZE = 1024
 
 class HexagonExtractor:
     """
     Extract hexagons with high confidence (green bounding boxes) from images
     """
     
-    def __init__(self, prediction_key: str, prediction_endpoint: str, project_id: str, model_name: str = "DCNE_lowres"):
+    def __init__(self, prediction_key: str, prediction_endpoint: str, project_id: str, model_name: str = "DCNE_lowres",
+                 cache_dir: str = os.path.join("output", "prediction_cache"), use_cache: bool = True,
+                 max_upload_dim: Optional[int] = None, save_workers: Optional[int] = None):
         """
         Initialize the Hexagon Extractor
         
@@ -19,11 +84,36 @@ class HexagonExtractor:
             prediction_endpoint: Your Custom Vision prediction endpoint
             project_id: Your Custom Vision project ID
             model_name: Name of your published model (default: "DCNE_lowres")
+            cache_dir: Directory for cached prediction results (shared with DCNE.py)
+            use_cache: Whether to reuse cached predictions for identical images
+            max_upload_dim: Downscale images so neither side exceeds this before upload (optional)
+            save_workers: Number of threads encoding crops (default: CPU count)
         """
         self.prediction_key = prediction_key
         self.prediction_endpoint = prediction_endpoint
         self.project_id = project_id
         self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.cache_ttl = float(os.environ.get('DCNE_CACHE_TTL', 24 * 3600))
+        self.max_upload_dim = max_upload_dim
+        
+        # In-memory LRU of recent predictions (cache key -> (time stored, predictions)) so
+        # repeated images within one process skip the disk cache as well as the network
+        self._memory_cache = OrderedDict()
+        self._memory_cache_lock = threading.Lock()
+        
+        # Arguments for rebuilding this extractor in batch worker processes
+        self.worker_kwargs = {
+            'prediction_key': prediction_key,
+            'prediction_endpoint': prediction_endpoint,
+            'project_id': project_id,
+            'model_name': model_name,
+            'cache_dir': cache_dir,
+            'use_cache': use_cache,
+            'max_upload_dim': max_upload_dim,
+            'save_workers': 1
+        }
         
         # Construct the prediction URL
         endpoint = prediction_endpoint.rstrip('/')
@@ -34,41 +124,210 @@ class HexagonExtractor:
             'Prediction-Key': prediction_key,
             'Content-Type': 'application/octet-stream'
         }
+        
+        # Persistent session so repeated predictions reuse keep-alive connections
+        # instead of opening a new TLS connection per image
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                        allowed_methods=frozenset(['POST']))
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retries))
+        self.session.headers.update(self.headers)
+        
+        # PNG encoding releases the GIL, so crops are saved on a thread pool
+        self._save_pool = ThreadPoolExecutor(max_workers=save_workers or os.cpu_count())
+    
+    def close(self):
+        """
+        Close the HTTP session and its pooled connections, and stop the save threads
+        """
+        self.session.close()
+        self._save_pool.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _cache_path(self, image_data: bytes) -> str:
+        """
+        Build the cache file path for an image from its content hash
+        
+        Args:
+            image_data: Raw bytes of the image file
+            
+        Returns:
+            Path of the cache file for this image and model (same naming as DCNE.py)
+        """
+        key = hashlib.sha256(image_data).hexdigest()
+        # Predictions on downscaled uploads are kept apart from full-size ones
+        if self.max_upload_dim:
+            key += f"_max{self.max_upload_dim}"
+        return os.path.join(self.cache_dir, f"{self.project_id}_{self.model_name}_{key}.json")
+    
+    def _prepare_upload(self, image_data: bytes) -> bytes:
+        """
+        Downscale an image for upload if it is larger than max_upload_dim
+        
+        Args:
+            image_data: Raw bytes of the image file
+            
+        Returns:
+            Bytes to send to the prediction endpoint
+        """
+        if not self.max_upload_dim:
+            return image_data
+        
+        image = Image.open(io.BytesIO(image_data))
+        if max(image.size) <= self.max_upload_dim:
+            return image_data
+        
+        # Let the JPEG decoder scale down while decoding, then finish the resize
+        image.draft('RGB', (self.max_upload_dim, self.max_upload_dim))
+        image.thumbnail((self.max_upload_dim, self.max_upload_dim), Image.Resampling.BILINEAR)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90)
+        return buffer.getvalue()
+    
+    def _get_memory_cached(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up predictions in the in-memory cache, dropping the entry if it has expired
+        
+        Args:
+            cache_key: Cache key of the image (its cache file path)
+            
+        Returns:
+            Cached prediction results, or None if missing or expired
+        """
+        with self._memory_cache_lock:
+            entry = self._memory_cache.get(cache_key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.cache_ttl:
+                del self._memory_cache[cache_key]
+                return None
+            self._memory_cache.move_to_end(cache_key)
+            return entry[1]
+    
+    def _set_memory_cached(self, cache_key: str, predictions: Dict[str, Any]):
+        """
+        Store predictions in the in-memory cache, evicting the least recently used entry when full
+        
+        Args:
+            cache_key: Cache key of the image (its cache file path)
+            predictions: Prediction results from the model
+        """
+        with self._memory_cache_lock:
+            self._memory_cache[cache_key] = (time.monotonic(), predictions)
+            self._memory_cache.move_to_end(cache_key)
+            if len(self._memory_cache) > MEMORY_CACHE_SIZE:
+                self._memory_cache.popitem(last=False)
+    
+    def _load_cached_predictions(self, cache_path: str) -> Dict[str, Any]:
+        """
+        Load cached predictions if present and not older than the cache TTL
+        
+        Args:
+            cache_path: Path of the cache file
+            
+        Returns:
+            Cached prediction results, or None if missing or expired
+        """
+        try:
+            if time.time() - os.path.getmtime(cache_path) > self.cache_ttl:
+                return None
+            with open(cache_path, 'rb') as f:
+                return orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+    
+    def _save_cached_predictions(self, cache_path: str, predictions: Dict[str, Any]):
+        """
+        Atomically write prediction results to the cache
+        
+        Args:
+            cache_path: Path of the cache file
+            predictions: Prediction results from the model
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(orjson.dumps(predictions))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not write prediction cache: {str(e)}")
     
-    def detect_objects_from_file(self, image_path: str) -> Dict[str, Any]:
+    def detect_objects_from_file(self, image_path: str, image_data: Optional[bytes] = None) -> Dict[str, Any]:
         """
         Detect objects in an image file
         
         Args:
             image_path: Path to the image file
+            image_data: Contents of the file if the caller already read it (optional)
             
         Returns:
             Dictionary containing prediction results
         """
         try:
-            # Open and read the image file
-            with open(image_path, "rb") as image_file:
-                image_data = image_file.read()
+            # Open and read the image file unless its bytes were passed in
+            if image_data is None:
+                with open(image_path, "rb") as image_file:
+                    image_data = image_file.read()
+            
+            # Reuse a previous result for identical image content
+            if self.use_cache:
+                cache_path = self._cache_path(image_data)
+                cached = self._get_memory_cached(cache_path)
+                if cached is not None:
+                    return cached
+                cached = self._load_cached_predictions(cache_path)
+                if cached is not None:
+                    self._set_memory_cached(cache_path, cached)
+                    return cached
             
-            # Make the prediction request
-            response = requests.post(
+            # Make the prediction request; bounding boxes come back normalized,
+            # so predictions on a downscaled upload still apply to the original image
+            response = self.session.post(
                 self.prediction_url,
-                headers=self.headers,
-                data=image_data
+                data=self._prepare_upload(image_data)
             )
             
             # Check if the request was successful
             response.raise_for_status()
             
             # Parse the JSON response
-            predictions = response.json()
+            predictions = orjson.loads(response.content)
+            
+            if self.use_cache:
+                self._set_memory_cached(cache_path, predictions)
+                self._save_cached_predictions(cache_path, predictions)
             return predictions
             
         except Exception as e:
             print(f"Error detecting objects: {str(e)}")
             return None
     
-    def extract_hexagons(self, image_path: str, output_dir: str, confidence_threshold: float = 0.70):
+    def read_and_detect(self, image_path: str):
+        """
+        Read an image file and get its predictions
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            Tuple of the file contents and the prediction results
+        """
+        with open(image_path, "rb") as image_file:
+            image_data = image_file.read()
+        return image_data, self.detect_objects_from_file(image_path, image_data)
+    
+    def extract_hexagons(self, image_path: str, output_dir: str, confidence_threshold: float = 0.70,
+                         predictions: Optional[Dict[str, Any]] = None, crop_format: str = 'png',
+                         image_data: Optional[bytes] = None):
         """
         Extract hexagons with high confidence (green bounding boxes) from an image
         
@@ -76,28 +335,34 @@ class HexagonExtractor:
             image_path: Path to the input image
             output_dir: Directory to save extracted hexagons
             confidence_threshold: Minimum confidence for extraction (default: 0.70 for green boxes)
+            predictions: Prediction results already fetched for this image (optional)
+            crop_format: File format for the extracted crops: 'png', 'jpeg' or 'webp' (default: 'png')
+            image_data: Contents of the image file if already read (optional)
+            
+        Returns:
+            Number of hexagon crops saved, or None if extraction failed
         """
         try:
             # Get image name without extension for folder naming
             image_name = os.path.splitext(os.path.basename(image_path))[0]
             
-            # Create subfolder for this image
+            # Create subfolder for this image (safe if another worker already created it)
             image_output_dir = os.path.join(output_dir, image_name)
-            if not os.path.exists(image_output_dir):
-                os.makedirs(image_output_dir)
-                print(f"Created subfolder: {image_output_dir}")
+            os.makedirs(image_output_dir, exist_ok=True)
+            
+            # Read the file once; the same bytes are uploaded and decoded for cropping
+            if image_data is None:
+                with open(image_path, "rb") as image_file:
+                    image_data = image_file.read()
             
             # Detect objects in the image
-            print(f"Detecting hexagons in: {os.path.basename(image_path)}")
-            predictions = self.detect_objects_from_file(image_path)
+            if predictions is None:
+                print(f"Detecting hexagons in: {os.path.basename(image_path)}")
+                predictions = self.detect_objects_from_file(image_path, image_data)
             
             if not predictions or 'predictions' not in predictions:
                 print("No predictions found.")
-                return
-            
-            # Open the image
-            image = Image.open(image_path)
-            img_width, img_height = image.size
+                return 0
             
             # Filter predictions for high confidence (green boxes)
             high_confidence_predictions = [
@@ -108,48 +373,69 @@ class HexagonExtractor:
             print(f"Found {len(high_confidence_predictions)} hexagons with confidence >= {confidence_threshold:.0%}")
             
             extracted_count = 0
+            if not high_confidence_predictions:
+                # Nothing to crop, so don't decode the image at all
+                print(f"Successfully extracted {extracted_count} hexagons to: {image_output_dir}")
+                return extracted_count
+            
+            # Open the image; only the header is parsed here
+            image = Image.open(io.BytesIO(image_data))
+            img_width, img_height = image.size
+            
+            # Compute all crop boxes at once from the normalized (left, top, width, height) boxes
+            boxes = np.array([
+                [bbox['left'], bbox['top'], bbox['width'], bbox['height']]
+                for bbox in (pred['boundingBox'] for pred in high_confidence_predictions)
+            ], dtype=np.float64).reshape(-1, 4)
+            size = np.array([img_width, img_height, img_width, img_height], dtype=np.float64)
+            boxes = (boxes * size).astype(np.int64)
+            top_left, box_size = boxes[:, :2], boxes[:, 2:]
+            
+            # Add some padding around the hexagon (10% of the box size), clamped to the image
+            padding = (box_size * 0.1).astype(np.int64)
+            crop_boxes = np.hstack([
+                np.maximum(top_left - padding, 0),
+                np.minimum(top_left + box_size + padding, size[2:].astype(np.int64))
+            ]).tolist()
+            
+            # Decode once up front so the worker threads only read the shared pixels
+            image.load()
             
             # Process each high-confidence prediction
-            for i, prediction in enumerate(high_confidence_predictions):
-                tag_name = prediction['tagName']
+            extension, pil_format, save_options = CROP_FORMATS[crop_format]
+            save_futures = []
+            lines = []
+            for i, (prediction, crop_box) in enumerate(zip(high_confidence_predictions, crop_boxes)):
                 probability = prediction['probability']
-                bbox = prediction['boundingBox']
-                
-                # Convert relative coordinates to absolute pixels
-                left = int(bbox['left'] * img_width)
-                top = int(bbox['top'] * img_height)
-                width = int(bbox['width'] * img_width)
-                height = int(bbox['height'] * img_height)
-                
-                # Add some padding around the hexagon (10% of the box size)
-                padding_x = int(width * 0.1)
-                padding_y = int(height * 0.1)
-                
-                # Calculate crop coordinates with padding
-                crop_left = max(0, left - padding_x)
-                crop_top = max(0, top - padding_y)
-                crop_right = min(img_width, left + width + padding_x)
-                crop_bottom = min(img_height, top + height + padding_y)
-                
-                # Crop the hexagon from the image
-                hexagon_crop = image.crop((crop_left, crop_top, crop_right, crop_bottom))
                 
                 # Create filename for the extracted hexagon
-                hexagon_filename = f"hexagon_{i+1:03d}_conf_{probability:.0%}.png"
+                hexagon_filename = f"hexagon_{i+1:03d}_conf_{probability:.0%}{extension}"
                 hexagon_path = os.path.join(image_output_dir, hexagon_filename)
                 
-                # Save the extracted hexagon
-                hexagon_crop.save(hexagon_path, 'PNG')
+                # Crop and save the hexagon in one background task, so each crop buffer only
+                # lives until it is encoded instead of queueing up behind the encoder
+                save_futures.append(self._save_pool.submit(
+                    save_hexagon_crop, image, tuple(crop_box), hexagon_path, pil_format, save_options
+                ))
                 extracted_count += 1
                 
-                print(f"  Extracted: {hexagon_filename} (confidence: {probability:.2%})")
+                lines.append(f"  Extracted: {hexagon_filename} (confidence: {probability:.2%})")
+            
+            # Wait for all crops to be written; re-raises the first save error
+            for future in save_futures:
+                future.result()
             
-            print(f"Successfully extracted {extracted_count} hexagons to: {image_output_dir}")
+            # Report the whole image in one write instead of a print per hexagon
+            lines.append(f"Successfully extracted {extracted_count} hexagons to: {image_output_dir}")
+            sys.stdout.write("\n".join(lines) + "\n")
+            return extracted_count
             
         except Exception as e:
             print(f"Error extracting hexagons: {str(e)}")
+            return None
     
-    def batch_extract_hexagons(self, input_dir: str, output_dir: str, confidence_threshold: float = 0.70):
+    def batch_extract_hexagons(self, input_dir: str, output_dir: str, confidence_threshold: float = 0.70,
+                               max_workers: int = 8, crop_format: str = 'png', processes: Optional[int] = None):
         """
         Extract hexagons from all images in a directory
         
@@ -157,47 +443,125 @@ class HexagonExtractor:
             input_dir: Directory containing input images
             output_dir: Directory to save extracted hexagons
             confidence_threshold: Minimum confidence for extraction
+            max_workers: Number of images sent to the prediction endpoint concurrently
+            crop_format: File format for the extracted crops
+            processes: Number of processes decoding, cropping and saving images (default: CPU count)
         """
         # Create main output directory
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            print(f"Created main output directory: {output_dir}")
-        
-        # Supported image formats
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'}
+        os.makedirs(output_dir, exist_ok=True)
         
         # Find all images
-        image_files = []
-        for filename in os.listdir(input_dir):
-            if any(filename.lower().endswith(ext) for ext in image_extensions):
-                image_files.append(os.path.join(input_dir, filename))
+        image_files = list(iter_images_in_directory(input_dir))
         
         print(f"Found {len(image_files)} images to process")
         
-        for i, image_path in enumerate(image_files, 1):
-            print(f"\n{'='*60}")
-            print(f"Processing image {i}/{len(image_files)}: {os.path.basename(image_path)}")
-            print(f"{'='*60}")
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = min(processes, len(image_files))
+        
+        if processes > 1:
+            # File reads and predictions are network-bound and stay on threads here; each image's
+            # decode, crop and encode runs in a worker process on the bytes already read, as soon
+            # as its prediction arrives. Workers return their output so it can be printed in file
+            # order. They are spawned rather than forked, so they never inherit locks held by the
+            # HTTP threads
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_batch_worker,
+                                     initargs=(self.worker_kwargs,)) as process_pool, \
+                 ThreadPoolExecutor(max_workers=max_workers) as executor:
+                jobs = [
+                    process_pool.submit(_extract_in_batch_worker, image_path, output_dir,
+                                        confidence_threshold, predictions, crop_format, image_data)
+                    for image_path, (image_data, predictions)
+                    in zip(image_files, executor.map(self.read_and_detect, image_files))
+                ]
+                
+                for i, (image_path, job) in enumerate(zip(image_files, jobs), 1):
+                    print(f"\n{'='*60}\n"
+                          f"Processing image {i}/{len(image_files)}: {os.path.basename(image_path)}\n"
+                          f"{'='*60}")
+                    
+                    try:
+                        sys.stdout.write(job.result())
+                    except Exception as e:
+                        print(f"Error processing {image_path}: {str(e)}")
             
-            try:
-                self.extract_hexagons(image_path, output_dir, confidence_threshold)
-            except Exception as e:
-                print(f"Error processing {image_path}: {str(e)}")
+            print(f"\nBatch extraction complete! All hexagons saved in: {output_dir}")
+            return
+        
+        # File reads and predictions run on the I/O threads, keeping up to max_workers images
+        # ahead of the cropping loop so only that many files are held in memory; each image
+        # is cropped as soon as it is ready, in file order, to keep the output readable
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            remaining = iter(image_files)
+            for image_path in remaining:
+                pending.append(executor.submit(self.read_and_detect, image_path))
+                if len(pending) >= max_workers:
+                    break
+            
+            for i, image_path in enumerate(image_files, 1):
+                job = pending.popleft()
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    pending.append(executor.submit(self.read_and_detect, next_path))
+                
+                print(f"\n{'='*60}\n"
+                      f"Processing image {i}/{len(image_files)}: {os.path.basename(image_path)}\n"
+                      f"{'='*60}")
+                
+                try:
+                    image_data, predictions = job.result()
+                    self.extract_hexagons(image_path, output_dir, confidence_threshold, predictions, crop_format,
+                                          image_data)
+                except Exception as e:
+                    print(f"Error processing {image_path}: {str(e)}")
         
         print(f"\nBatch extraction complete! All hexagons saved in: {output_dir}")
 
+# Extractor used by a batch worker process, created once when the process starts
+_batch_worker_extractor = None
+
+def _init_batch_worker(extractor_kwargs: Dict[str, Any]):
+    """
+    Create the extractor for a batch worker process
+    """
+    global _batch_worker_extractor
+    _batch_worker_extractor = HexagonExtractor(**extractor_kwargs)
+
+def _extract_in_batch_worker(image_path: str, output_dir: str, confidence_threshold: float,
+                             predictions: Optional[Dict[str, Any]], crop_format: str,
+                             image_data: Optional[bytes] = None) -> str:
+    """
+    Extract hexagons from one image in a batch worker process
+    
+    Returns:
+        Console output of the extraction
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        _batch_worker_extractor.extract_hexagons(image_path, output_dir, confidence_threshold,
+                                                 predictions, crop_format, image_data)
+    return output.getvalue()
+
+@functools.lru_cache(maxsize=4)
+def _read_config(config_file: str) -> Dict[str, str]:
+    """
+    Parse a JSON configuration file once per process
+    """
+    with open(config_file, 'rb') as f:
+        return orjson.loads(f.read())
+
 def load_config(config_file: str = "config.json") -> Dict[str, str]:
     """
     Load configuration from a JSON file
     """
     try:
-        with open(config_file, 'r') as f:
-            config = json.load(f)
-        return config
+        return _read_config(config_file)
     except FileNotFoundError:
         print(f"Configuration file '{config_file}' not found.")
         return None
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"Error parsing configuration file '{config_file}'.")
         return None
 
@@ -211,6 +575,11 @@ def main():
     parser.add_argument('--config', '-c', default='config.json', help='Configuration file path')
     parser.add_argument('--threshold', '-t', type=float, default=0.70, help='Confidence threshold for extraction (default: 0.70)')
     parser.add_argument('--batch', action='store_true', help='Process all images in input directory')
+    parser.add_argument('--crop-format', choices=sorted(CROP_FORMATS), default='png', help='File format for extracted hexagons (default: png)')
+    parser.add_argument('--max-upload-dim', type=int, help='Downscale images so neither side exceeds this many pixels before upload (optional)')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the prediction API instead of reusing cached results')
+    parser.add_argument('--processes', type=int, help='Number of processes cropping images in batch mode (default: CPU count)')
+    parser.add_argument('--workers', type=int, default=8, help='Number of concurrent prediction requests in batch mode (default: 8)')
     
     args = parser.parse_args()
     
@@ -220,28 +589,31 @@ def main():
         return
     
     # Initialize the extractor
-    extractor = HexagonExtractor(
+    with HexagonExtractor(
         prediction_key=config['prediction_key'],
         prediction_endpoint=config['prediction_endpoint'],
         project_id=config['project_id'],
-        model_name=config.get('model_name', 'DCNE_lowres')
-    )
-    
-    if args.batch:
-        # Batch processing
-        if not os.path.isdir(args.input):
-            print(f"Error: {args.input} is not a directory")
-            return
+        model_name=config.get('model_name', 'DCNE_lowres'),
+        use_cache=not args.no_cache,
+        max_upload_dim=args.max_upload_dim
+    ) as extractor:
         
-        extractor.batch_extract_hexagons(args.input, args.output, args.threshold)
-    
-    else:
-        # Single file processing
-        if not os.path.isfile(args.input):
-            print(f"Error: {args.input} is not a file")
-            return
+        if args.batch:
+            # Batch processing
+            if not os.path.isdir(args.input):
+                print(f"Error: {args.input} is not a directory")
+                return
+            
+            extractor.batch_extract_hexagons(args.input, args.output, args.threshold, args.workers,
+                                             args.crop_format, args.processes)
         
-        extractor.extract_hexagons(args.input, args.output, args.threshold)
+        else:
+            # Single file processing
+            if not os.path.isfile(args.input):
+                print(f"Error: {args.input} is not a file")
+                return
+            
+            extractor.extract_hexagons(args.input, args.output, args.threshold, crop_format=args.crop_format)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
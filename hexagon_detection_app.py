@@ -2,13 +2,22 @@ import streamlit as st
 import os
 import tempfile
 import time
-import json
+import io
+import orjson
+import shutil
 import uuid
-from PIL import Image
-import subprocess
-import sys
+import hashlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from deployment_config import resolve_base_dirs
+
+# Pipeline stages run in-process, so the interpreter, imports and HTTP sessions are reused.
+# PIL and the stage modules (which pull in numpy, matplotlib and requests) are imported on
+# first use so the landing page renders without loading them.
+
 # Page configuration
 st.set_page_config(
     page_title="DCNE Demo",
@@ -17,48 +26,40 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Add custom CSS to remove all top spacing
-st.markdown("""
+# Custom CSS for styling and removing Streamlit's top spacing, injected in a single block
+APP_CSS = """
 <style>
-    /* Remove all top spacing from Streamlit */
+    /* Remove all top spacing from Streamlit and the browser defaults */
+    body,
     .stApp {
         margin: 0 !important;
         padding: 0 !important;
     }
     
-    .main .block-container {
-        padding-top: 0 !important;
-        padding-bottom: 0 !important;
+    .stApp > div,
+    .main .block-container > div:first-child {
         margin-top: 0 !important;
     }
     
+    .main .block-container,
     section[data-testid="stSidebar"] {
         padding-top: 0 !important;
         margin-top: 0 !important;
     }
     
-    .css-1d391kg {
-        padding-top: 0 !important;
-        margin-top: 0 !important;
+    .main .block-container {
+        padding-bottom: 0 !important;
     }
     
-    /* Remove any default browser margins */
-    body {
-        margin: 0 !important;
-        padding: 0 !important;
+    .main .block-container > div {
+        padding-top: 0 !important;
     }
     
-    /* Target the main content wrapper */
-    .main .block-container > div:first-child {
-        padding-top: 0 !important;
-        margin-top: 0 !important;
+    /* Adjust sidebar title positioning */
+    section[data-testid="stSidebar"] > div:first-child {
+        padding-top: 0.5rem !important;
     }
-</style>
-""", unsafe_allow_html=True)
-
-# Custom CSS for styling
-st.markdown("""
-<style>
+    
     .main-header {
         font-size: 3rem;
         font-weight: bold;
@@ -74,8 +75,6 @@ st.markdown("""
         border-radius: 10px;
         text-align: center;
         margin-bottom: 1rem; /* Reduced from 2rem */
-        /* Removed: border: 2px dashed #dee2e6; */
-        /* Removed: background-color: #f8f9fa; */
     }
     
     .progress-container {
@@ -148,6 +147,11 @@ st.markdown("""
         margin: 0.25rem 0;
     }
     
+    .duplicate-item.unique {
+        background-color: #d4edda;
+        border-color: #c3e6cb;
+    }
+    
     .debug-info {
         background-color: #f8f9fa;
         border: 1px solid #dee2e6;
@@ -159,149 +163,419 @@ st.markdown("""
         max-height: 200px;
         overflow-y: auto;
     }
+</style>
+"""
+
+st.markdown(APP_CSS, unsafe_allow_html=True)
+
+# Image types accepted by the uploader, built once instead of on every rerun
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({'jpg', 'jpeg', 'png', 'bmp', 'tiff'})
+UPLOAD_TYPES = sorted(ALLOWED_UPLOAD_EXTENSIONS)
+
+# Working folders in a deployment-friendly location. Any non-empty
+# DEPLOYMENT_MODE selects the deployment folders (STORAGE_TYPE picks local or shared storage)
+TEMP_BASE_DIR, OUTPUT_BASE_DIR = resolve_base_dirs('production' if os.environ.get('DEPLOYMENT_MODE') else 'development')
+RESULTS_CACHE_DIR = os.path.join(TEMP_BASE_DIR, "cache")
+PREDICTION_CACHE_DIR = os.path.join(OUTPUT_BASE_DIR, "prediction_cache")
+
+# Only the final mapped image is needed to show results; set DCNE_DEBUG_ARTIFACTS to also
+# write the annotated detection image and JSON and keep the mapping output in the job folder
+DEBUG_ARTIFACTS = bool(os.environ.get('DCNE_DEBUG_ARTIFACTS'))
+
+# Final images are published here and shown with a lazy-loading <img> tag when static
+# file serving is enabled (see .streamlit/config.toml)
+STATIC_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "results")
+
+# Size budget for the results cache; least recently used entries are evicted beyond it
+RESULTS_CACHE_MAX_BYTES = int(os.environ.get('DCNE_RESULTS_CACHE_MB', '512')) * 1024 * 1024
+PREDICTION_CACHE_MAX_BYTES = int(os.environ.get('DCNE_PREDICTION_CACHE_MB', '64')) * 1024 * 1024
+
+# Longest side of the result image shown on the page; the full-resolution file is offered as a download
+DISPLAY_IMAGE_MAX_SIZE = 1600
+
+# Job folders, cached results and published images untouched for this long are removed by a
+# sweep that runs at most once per TEMP_SWEEP_INTERVAL
+TEMP_DIR_TTL = int(os.environ.get('DCNE_TEMP_TTL', str(24 * 60 * 60)))
+TEMP_SWEEP_INTERVAL = 60 * 60
+
+def create_temp_directory(upload_hash):
+    """Create a unique processing directory for one pipeline run of an upload"""
+    # Each run gets its own folder so concurrent sessions with the same image never share
+    # crops or JSON; reuse of finished results goes through the content-addressed results cache
+    temp_dir = os.path.join(TEMP_BASE_DIR, f"job_{upload_hash[:12]}_{uuid.uuid4().hex[:8]}")
+    os.makedirs(temp_dir)
+    print(f"🔍 Temporary directory created: {temp_dir}")
+    return temp_dir
+
+@st.cache_resource
+def get_sweep_state():
+    """Time of the last stale-folder sweep, shared by all sessions of the server process"""
+    return {'last_sweep': 0.0}
+
+def sweep_stale_temp_directories():
+    """Remove job folders and cached results older than TEMP_DIR_TTL, at most once per TEMP_SWEEP_INTERVAL"""
+    sweep_state = get_sweep_state()
+    now = time.time()
+    if now - sweep_state['last_sweep'] < TEMP_SWEEP_INTERVAL:
+        return
+    sweep_state['last_sweep'] = now
     
-    /* Move sidebar and main content to the very top */
-    .css-1d391kg {
-        padding-top: 0 !important;
-    }
+    cutoff = now - TEMP_DIR_TTL
+    for base_dir in (TEMP_BASE_DIR, RESULTS_CACHE_DIR):
+        try:
+            with os.scandir(base_dir) as entries:
+                stale = [entry.path for entry in entries
+                         if entry.is_dir(follow_symlinks=False) and entry.path != RESULTS_CACHE_DIR
+                         and entry.stat(follow_symlinks=False).st_mtime < cutoff]
+        except FileNotFoundError:
+            continue
+        for path in stale:
+            shutil.rmtree(path, ignore_errors=True)
+        if stale:
+            print(f"Removed {len(stale)} stale folders from {base_dir}")
     
-    .main .block-container {
-        padding-top: 0 !important;
-    }
+    try:
+        with os.scandir(STATIC_RESULTS_DIR) as entries:
+            stale_images = [entry.path for entry in entries
+                            if entry.is_file(follow_symlinks=False)
+                            and entry.stat(follow_symlinks=False).st_mtime < cutoff]
+    except FileNotFoundError:
+        stale_images = []
+    for path in stale_images:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def count_directory_entries(path):
+    """Number of entries in a directory, or 0 if it does not exist"""
+    try:
+        with os.scandir(path) as entries:
+            return sum(1 for _ in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+
+def get_results_cache_dir():
+    """Directory holding pipeline results keyed by upload content hash"""
+    return RESULTS_CACHE_DIR
+
+def hash_upload(image_bytes):
+    """Content hash identifying an uploaded image"""
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+@st.cache_resource(max_entries=8)
+def open_uploaded_image(upload_hash, _image_bytes):
+    """Decode an uploaded image once; later reruns reuse it by content hash"""
+    from PIL import Image
     
-    /* Remove any default margins from Streamlit */
-    .stApp {
-        margin-top: 0 !important;
-    }
+    image = Image.open(io.BytesIO(_image_bytes))
+    image.load()
+    return image
+
+def load_cached_results(upload_hash):
+    """Load the pipeline results for an image processed before, if its outputs still exist"""
+    cache_dir = os.path.join(get_results_cache_dir(), upload_hash)
+    cache_path = os.path.join(cache_dir, "results.json")
+    try:
+        # Parsed once per file version; the results include the full duplicate analysis
+        results = load_json_cached(cache_path, os.path.getmtime(cache_path))
+    except (OSError, ValueError):
+        return None
     
-    /* Adjust sidebar title positioning */
-    .css-1d391kg .css-1lcbmhc {
-        padding-top: 0.5rem !important;
-    }
+    # The final image is kept next to the results, but may have been swept with the folder
+    if not os.path.exists(results['mapping_result']['mapped_image']):
+        return None
+    # Refresh the entry so the stale-folder sweep keeps results that are still being used
+    os.utime(cache_dir)
+    return results
+
+def save_cached_results(upload_hash, results):
+    """
+    Store pipeline results so the same image is not processed again
     
-    /* Target Streamlit's main container */
-    .main .block-container {
-        padding-top: 0 !important;
-        padding-bottom: 0 !important;
-    }
+    Returns:
+        The results as cached (pointing at the cached final image), or None if caching failed
+    """
+    cache_dir = os.path.join(get_results_cache_dir(), upload_hash)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        
+        # Copy the final image into the content-addressed entry so a cache hit does not
+        # depend on the job folder it was produced in still existing
+        mapped_image = results['mapping_result']['mapped_image']
+        cached_image = os.path.join(cache_dir, os.path.basename(mapped_image))
+        if os.path.abspath(mapped_image) != os.path.abspath(cached_image):
+            shutil.copyfile(mapped_image, cached_image)
+        cached_results = dict(results, mapping_result=dict(results['mapping_result'], mapped_image=cached_image))
+        
+        data = orjson.dumps(cached_results)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(cache_dir, "results.json"))
+        evict_results_cache(keep=upload_hash)
+        return cached_results
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        print(f"Could not cache pipeline results: {str(e)}")
+        return None
+
+def evict_results_cache(keep=None):
+    """
+    Remove the least recently used results cache entries until the cache fits RESULTS_CACHE_MAX_BYTES
     
-    /* Target the sidebar container */
-    section[data-testid="stSidebar"] {
-        padding-top: 0 !important;
-    }
+    Args:
+        keep: Entry (upload hash) that must not be evicted, such as the one just written
+    """
+    cache_root = get_results_cache_dir()
+    entries = []
+    total_size = 0
+    with os.scandir(cache_root) as cache_entries:
+        for entry in cache_entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            # Entries are touched when read, so the directory mtime is the last use
+            size = 0
+            with os.scandir(entry.path) as files:
+                for file_entry in files:
+                    if file_entry.is_file(follow_symlinks=False):
+                        size += file_entry.stat(follow_symlinks=False).st_size
+            entries.append((entry.stat(follow_symlinks=False).st_mtime, size, entry))
+            total_size += size
     
-    /* Target the main content area */
-    .main .block-container > div {
-        padding-top: 0 !important;
-    }
+    for _, size, entry in sorted(entries, key=lambda item: item[0]):
+        if total_size <= RESULTS_CACHE_MAX_BYTES:
+            break
+        if entry.name == keep:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        # The published copy of the result image goes with its cache entry
+        try:
+            os.remove(os.path.join(STATIC_RESULTS_DIR, get_static_image_name(entry.name)))
+        except OSError:
+            pass
+        total_size -= size
+
+def evict_prediction_cache():
+    """Remove the oldest Custom Vision prediction files until the cache fits PREDICTION_CACHE_MAX_BYTES"""
+    entries = []
+    total_size = 0
+    try:
+        with os.scandir(PREDICTION_CACHE_DIR) as cache_entries:
+            for entry in cache_entries:
+                # Skip temporary files that are still being written
+                if not entry.name.endswith('.json') or not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+    except FileNotFoundError:
+        return
     
-    /* Remove top margin from the app container */
-    .stApp > div {
-        margin-top: 0 !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+    for _, size, path in sorted(entries):
+        if total_size <= PREDICTION_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
 
-def create_temp_directory():
-    """Create a temporary directory for processing"""
-    # Create temp directory in a deployment-friendly location
+@st.cache_data(max_entries=64)
+def load_json_cached(path, mtime):
+    """Parse a pipeline JSON file; the modification time is part of the cache key so edits are picked up"""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+@st.cache_data(max_entries=16)
+def load_image_bytes_cached(path, mtime):
+    """Read an encoded output image once per file version"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+@st.cache_data(max_entries=16)
+def load_display_image_cached(path, mtime):
+    """Downscale an output image for on-page display and encode it as WebP, once per file version"""
+    from PIL import Image
     
-    # For deployment: Use system temp directory
-    if os.environ.get('DEPLOYMENT_MODE'):
-        # Production deployment
-        temp_dir = os.path.join(tempfile.gettempdir(), "hexagon_detection", f"hexagon_detection_{uuid.uuid4().hex[:8]}")
-    else:
-        # Development mode - use project folder
-        temp_dir = os.path.join(os.getcwd(), "temp-directory", f"hexagon_detection_{uuid.uuid4().hex[:8]}")
+    with Image.open(path) as image:
+        image.thumbnail((DISPLAY_IMAGE_MAX_SIZE, DISPLAY_IMAGE_MAX_SIZE), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'WEBP', quality=85, method=4)
+    return buffer.getvalue()
+
+def get_static_image_name(upload_hash):
+    """File name of an upload's result image in STATIC_RESULTS_DIR"""
+    return f"{upload_hash}.webp"
+
+def publish_static_image(image_data, name, version):
+    """
+    Write an encoded image into Streamlit's static folder so the browser can fetch it by URL
     
-    os.makedirs(temp_dir, exist_ok=True)
-    print(f"🔍 Temporary directory created: {temp_dir}")
-    return temp_dir
+    Args:
+        image_data: Encoded image bytes
+        name: File name to publish it under (see get_static_image_name)
+        version: Modification time (ns) of the result the image was made from
+        
+    Returns:
+        URL of the published image, or None if static serving is disabled or the copy failed
+    """
+    if not st.get_option("server.enableStaticServing"):
+        return None
+    
+    # The version in the query string makes browsers fetch the image again after reprocessing,
+    # since the file name stays the same
+    static_path = os.path.join(STATIC_RESULTS_DIR, name)
+    image_url = f"app/static/results/{name}?v={version}"
+    
+    # Reruns of the results view find the image already published for this result version
+    try:
+        static_stat = os.stat(static_path)
+        if static_stat.st_size == len(image_data) and static_stat.st_mtime_ns >= version:
+            return image_url
+    except FileNotFoundError:
+        pass
+    
+    # The temporary file and os.replace keep the browser from ever fetching a half-written file
+    tmp_path = f"{static_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        os.makedirs(STATIC_RESULTS_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(image_data)
+        os.replace(tmp_path, static_path)
+    except OSError as e:
+        print(f"Could not publish image: {str(e)}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return None
+    return image_url
+
+def load_app_config(config_path="config.json"):
+    """Load the pipeline configuration, or None if it is missing"""
+    if not os.path.exists(config_path):
+        return None
+    with open(config_path, 'rb') as f:
+        return orjson.loads(f.read())
+
+# Process-wide caches (not st.cache_resource) so stages can also run on worker threads,
+# which have no Streamlit script context
+@st.cache_resource
+def get_detector(prediction_key, prediction_endpoint, project_id, model_name):
+    """Create the Custom Vision detector once per server process so its session stays warm"""
+    from DCNE import CustomVisionObjectDetector
+    
+    return CustomVisionObjectDetector(
+        prediction_key=prediction_key,
+        prediction_endpoint=prediction_endpoint,
+        project_id=project_id,
+        model_name=model_name,
+        cache_dir=PREDICTION_CACHE_DIR
+    )
+
+@st.cache_resource
+def get_hexagon_extractor(prediction_key, prediction_endpoint, project_id, model_name):
+    """Create the hexagon extractor once per server process"""
+    from extract_hexagons import HexagonExtractor
+    
+    return HexagonExtractor(
+        prediction_key=prediction_key,
+        prediction_endpoint=prediction_endpoint,
+        project_id=project_id,
+        model_name=model_name,
+        cache_dir=PREDICTION_CACHE_DIR
+    )
+
+@st.cache_resource
+def get_info_extractor(api_key, endpoint, max_workers=16, max_requests_per_second=5.0):
+    """Create the GPT-4 Vision extractor once per server process"""
+    from extract_hexagon_info import HexagonInfoExtractor
+    
+    return HexagonInfoExtractor(api_key, endpoint, max_workers, max_requests_per_second)
+
+def run_timed(func, *args):
+    """Run a pipeline stage and return its result with the time it took"""
+    start_time = time.time()
+    result = func(*args)
+    return result, time.time() - start_time
 
-def run_dcne_detection(image_path, temp_dir):
-    """Run DCNE detection on the uploaded image"""
+def run_dcne_detection(image_path, temp_dir, save_artifacts=DEBUG_ARTIFACTS):
+    """Run DCNE detection on the uploaded image; save_artifacts also writes the annotated image and JSON"""
     try:
-        # Run DCNE detection - it will create output in the main output directory
-        cmd = [
-            sys.executable, "DCNE.py",
-            "--image", image_path,
-            "--upscale", "4.0",
-            "--threshold", "0.5"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
-        
-        if result.returncode == 0:
-            # Find the created output files in a deployment-friendly location
-            image_name = Path(image_path).stem
-            
-            # For deployment: Use system temp directory for outputs
-            if os.environ.get('DEPLOYMENT_MODE'):
-                # Production deployment
-                output_folder = os.path.join(tempfile.gettempdir(), "hexagon_output", image_name)
-            else:
-                # Development mode - use project folder
-                output_folder = os.path.join("output", image_name)
-            
-            if os.path.exists(output_folder):
-                annotated_image = os.path.join(output_folder, f"annotated_{image_name}.jpg")
-                detection_json = os.path.join(output_folder, f"annotated_{image_name}_detections.json")
-                
-                # Check if files actually exist
-                if os.path.exists(annotated_image) and os.path.exists(detection_json):
-                    return {
-                        'success': True,
-                        'annotated_image': annotated_image,
-                        'detection_json': detection_json,
-                        'output_folder': output_folder
-                    }
-                else:
-                    return {'success': False, 'error': f"Output files not found. Expected: {annotated_image}, {detection_json}"}
-            else:
-                return {'success': False, 'error': f"Output folder not found: {output_folder}"}
+        config = load_app_config()
+        if not config:
+            return {'success': False, 'error': "config.json not found"}
+        
+        detector = get_detector(config['prediction_key'], config['prediction_endpoint'],
+                                config['project_id'], config.get('model_name', 'DCNE_lowres'))
+        
+        predictions = detector.detect_objects_from_file(image_path)
+        if not predictions:
+            return {'success': False, 'error': "No predictions returned from the detection API"}
+        
+        # Later stages take the predictions in memory, so the upscaled annotated image is only
+        # rendered when debug artifacts are requested
+        if not save_artifacts:
+            return {
+                'success': True,
+                'annotated_image': None,
+                'detection_json': None,
+                'output_folder': None,
+                'predictions': predictions
+            }
+        
+        # Output folder in a deployment-friendly location
+        image_name = Path(image_path).stem
+        output_folder = os.path.join(OUTPUT_BASE_DIR, image_name)
+        os.makedirs(output_folder, exist_ok=True)
         
-        # If we get here, the command failed
-        error_msg = result.stderr if result.stderr else result.stdout
-        return {'success': False, 'error': f"Command failed with return code {result.returncode}: {error_msg}"}
+        annotated_image = os.path.join(output_folder, f"annotated_{image_name}.jpg")
+        detection_json = os.path.join(output_folder, f"annotated_{image_name}_detections.json")
+        detector.visualize_detections(image_path, predictions, annotated_image, 0.5, 4.0)
+        
+        # Check if files actually exist
+        if os.path.exists(annotated_image) and os.path.exists(detection_json):
+            return {
+                'success': True,
+                'annotated_image': annotated_image,
+                'detection_json': detection_json,
+                'output_folder': output_folder,
+                'predictions': predictions
+            }
+        return {'success': False, 'error': f"Output files not found. Expected: {annotated_image}, {detection_json}"}
         
     except Exception as e:
         return {'success': False, 'error': f"Exception occurred: {str(e)}"}
 
-def run_hexagon_extraction(image_path, temp_dir):
-    """Run hexagon extraction"""
+def run_hexagon_extraction(image_path, temp_dir, image_data=None, predictions=None):
+    """Run hexagon extraction; image_data and predictions are reused from earlier steps when given"""
     try:
+        config = load_app_config()
+        if not config:
+            return {'success': False, 'error': "config.json not found"}
+        
         # Create extraction directory in temp_dir
         extraction_dir = os.path.join(temp_dir, "extracted_hexagons")
         os.makedirs(extraction_dir, exist_ok=True)
         
         # Run extraction
-        cmd = [
-            sys.executable, "extract_hexagons.py",
-            image_path,
-            "--output", extraction_dir,
-            "--threshold", "0.70"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
-        
-        if result.returncode == 0:
-            # Find the extracted hexagons folder
-            image_name = Path(image_path).stem
-            hexagons_folder = os.path.join(extraction_dir, image_name)
-            
-            if os.path.exists(hexagons_folder):
-                hexagon_files = [f for f in os.listdir(hexagons_folder) if f.endswith('.png')]
-                return {
-                    'success': True,
-                    'hexagons_folder': hexagons_folder,
-                    'hexagon_count': len(hexagon_files)
-                }
-            else:
-                return {'success': False, 'error': f"Hexagons folder not found: {hexagons_folder}"}
+        extractor = get_hexagon_extractor(config['prediction_key'], config['prediction_endpoint'],
+                                          config['project_id'], config.get('model_name', 'DCNE_lowres'))
+        hexagon_count = extractor.extract_hexagons(image_path, extraction_dir, 0.70, predictions=predictions,
+                                                   image_data=image_data)
+        
+        # Find the extracted hexagons folder
+        image_name = Path(image_path).stem
+        hexagons_folder = os.path.join(extraction_dir, image_name)
         
-        # If we get here, the command failed
-        error_msg = result.stderr if result.stderr else result.stdout
-        return {'success': False, 'error': f"Command failed with return code {result.returncode}: {error_msg}"}
+        if os.path.exists(hexagons_folder):
+            # The extractor reports how many crops it saved, whatever their format
+            return {
+                'success': True,
+                'hexagons_folder': hexagons_folder,
+                'hexagon_count': hexagon_count or 0
+            }
+        return {'success': False, 'error': f"Hexagons folder not found: {hexagons_folder}"}
         
     except Exception as e:
         return {'success': False, 'error': f"Exception occurred: {str(e)}"}
@@ -310,13 +584,10 @@ def run_hexagon_validation(hexagons_folder, temp_dir):
     """Run GPT-4 validation with proper configuration"""
     try:
         # Load configuration
-        config_path = "config.json"
-        if not os.path.exists(config_path):
+        config = load_app_config()
+        if not config:
             return {'success': False, 'error': "config.json not found"}
         
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-        
         # Check for OpenAI API key
         openai_api_key = config.get('openai_api_key')
         
@@ -326,111 +597,375 @@ def run_hexagon_validation(hexagons_folder, temp_dir):
         # Get the folder name to determine the expected file prefix
         folder_name = os.path.basename(hexagons_folder)
         
-        # The extract_hexagon_info.py script creates files in the hexagon folder
+        # The extractor creates files in the hexagon folder
         # Use the exact output path that will be created
         validation_json = os.path.join(hexagons_folder, f"hexagon_validation_{folder_name}.json")
-        true_hexagons_json = os.path.join(hexagons_folder, f"hexagon_validation_{folder_name}_true_hexagons.json")
         
         # Run validation with proper API key and Azure endpoint
-        cmd = [
-            sys.executable, "extract_hexagon_info.py",
-            hexagons_folder,
-            "--output", validation_json,
-            "--api-key", openai_api_key,
-            "--endpoint", config.get('openai_endpoint', 'https://api.openai.com/v1/chat/completions')
-        ]
+        endpoint = config.get('openai_endpoint', 'https://api.openai.com/v1/chat/completions')
         
         # Store debug info for sidebar
         debug_info = {
-            'command': ' '.join(cmd),
-            'return_code': None,
-            'stdout': None,
-            'stderr': None,
+            'command': f"HexagonInfoExtractor.process_hexagon_folder({hexagons_folder!r}, {validation_json!r})",
             'created_files': None
         }
         
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
+        # Hexagons are validated concurrently; the limits can be tuned to the API quota in config.json
+        info_extractor = get_info_extractor(openai_api_key, endpoint,
+                                            int(config.get('openai_max_workers', 16)),
+                                            float(config.get('openai_requests_per_second', 5.0)))
+        results = info_extractor.process_hexagon_folder(hexagons_folder, validation_json)
         
-        # Update debug info
-        debug_info['return_code'] = result.returncode
-        debug_info['stdout'] = result.stdout
-        debug_info['stderr'] = result.stderr
+        # The extractor creates both the main validation file and the true hexagons file
+        # Let's check what files were actually created
+        created_files = os.listdir(hexagons_folder)
+        debug_info['created_files'] = created_files
         
-        if result.returncode == 0:
-            # The script creates both the main validation file and the true hexagons file
-            # Let's check what files were actually created
-            created_files = os.listdir(hexagons_folder)
-            debug_info['created_files'] = created_files
-            
-            # Look for the true hexagons file with the correct naming pattern
-            true_hexagons_file = None
-            for file in created_files:
-                if "true_hexagons" in file and file.endswith('.json'):
-                    true_hexagons_file = os.path.join(hexagons_folder, file)
-                    break
-            
-            if true_hexagons_file and os.path.exists(true_hexagons_file):
-                # Load true hexagons data
-                with open(true_hexagons_file, 'r', encoding='utf-8') as f:
-                    true_hexagons = json.load(f)
-                
-                return {
-                    'success': True,
-                    'validation_json': validation_json,
-                    'true_hexagons_json': true_hexagons_file,
-                    'true_hexagons': true_hexagons,
-                    'true_count': len(true_hexagons),
-                    'debug_info': debug_info
-                }
-            else:
-                return {'success': False, 'error': f"True hexagons file not found. Available files: {created_files}", 'debug_info': debug_info}
+        # Look for the true hexagons file with the correct naming pattern
+        true_hexagons_file = None
+        for file in created_files:
+            if "true_hexagons" in file and file.endswith('.json'):
+                true_hexagons_file = os.path.join(hexagons_folder, file)
+                break
         
-        # If we get here, the command failed
-        error_msg = result.stderr if result.stderr else result.stdout
-        return {'success': False, 'error': f"Command failed with return code {result.returncode}: {error_msg}", 'debug_info': debug_info}
+        if true_hexagons_file and os.path.exists(true_hexagons_file):
+            # Load true hexagons data
+            # Use the results returned in memory; the file is only read if they are unavailable
+            if results is not None:
+                true_hexagons = [result for result in results if result.get('is_hexagon', False)]
+            else:
+                true_hexagons = load_json_cached(true_hexagons_file, os.path.getmtime(true_hexagons_file))
+            
+            return {
+                'success': True,
+                'validation_json': validation_json,
+                'true_hexagons_json': true_hexagons_file,
+                'true_hexagons': true_hexagons,
+                'true_count': len(true_hexagons),
+                'debug_info': debug_info
+            }
+        return {'success': False, 'error': f"True hexagons file not found. Available files: {created_files}", 'debug_info': debug_info}
         
     except Exception as e:
         return {'success': False, 'error': f"Exception occurred: {str(e)}"}
 
-def run_enhanced_mapping(original_image, true_hexagons_json, detection_json, temp_dir):
-    """Run enhanced hexagon mapping"""
+def run_enhanced_mapping(original_image, true_hexagons_json, detection_json, temp_dir,
+                         true_hexagons=None, predictions=None, output_dir=None):
+    """Run enhanced hexagon mapping, using in-memory stage results when given; output_dir defaults to temp_dir/mapping"""
     try:
+        from enhanced_hexagon_processor import map_true_hexagons_to_image
+        
         # Create mapping output directory
-        mapping_dir = os.path.join(temp_dir, "mapping")
+        mapping_dir = output_dir or os.path.join(temp_dir, "mapping")
         os.makedirs(mapping_dir, exist_ok=True)
         
         # Run enhanced mapping
-        cmd = [
-            sys.executable, "enhanced_hexagon_processor.py",
-            original_image,
-            true_hexagons_json,
-            "--detection-json", detection_json,
-            "--output", os.path.join(mapping_dir, "final_mapped_image.jpg")
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
-        
-        if result.returncode == 0:
-            mapped_image = os.path.join(mapping_dir, "final_mapped_image.jpg")
-            duplicate_analysis = os.path.join(mapping_dir, "final_mapped_image_duplicate_analysis.json")
-            
-            duplicate_data = {}
-            if os.path.exists(duplicate_analysis):
-                with open(duplicate_analysis, 'r', encoding='utf-8') as f:
-                    duplicate_data = json.load(f)
-            
+        mapped_image = os.path.join(mapping_dir, "final_mapped_image.jpg")
+        detection_data = {'predictions': predictions} if predictions is not None else None
+        duplicate_data = map_true_hexagons_to_image(original_image, true_hexagons_json, mapped_image, detection_json,
+                                                    true_hexagons=true_hexagons, detection_data=detection_data)
+        if duplicate_data:
             return {
                 'success': True,
                 'mapped_image': mapped_image,
                 'duplicate_analysis': duplicate_data
             }
         
-        return {'success': False, 'error': result.stderr}
+        return {'success': False, 'error': "Mapping failed; see the server log for details"}
         
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+# Pipeline runs are queued on a shared worker pool so the script thread stays free to
+# handle reruns (such as the Stop button) while stages are in flight
+PIPELINE_WORKERS = int(os.environ.get('DCNE_PIPELINE_WORKERS', '2'))
+PIPELINE_POLL_INTERVAL = 1.0  # seconds between progress checks while a job is running
+STEP_NAMES = ["Detection", "Extraction", "Validation", "Mapping"]
+
+@st.cache_resource
+def get_pipeline_executor():
+    """Create the pipeline worker pool once per server process"""
+    return ThreadPoolExecutor(max_workers=PIPELINE_WORKERS)
+
+class PipelineJob:
+    """Progress of one background pipeline run; written by the worker, read by the script"""
+    
+    def __init__(self, upload_hash, image_path, image_data, temp_dir):
+        self.upload_hash = upload_hash
+        self.image_path = image_path
+        self.image_data = image_data
+        self.temp_dir = temp_dir
+        self.cancel_event = threading.Event()
+        self.completed_steps = []
+        self.step_times = {}
+        self.messages = []
+        self.failed_step = None
+        self.error = None
+        self.results = None
+        self.future = None
+    
+    def record_step(self, step, result, step_time, message):
+        """
+        Record a finished stage
+        
+        Args:
+            step: Index of the stage in STEP_NAMES
+            result: Result dictionary returned by the stage
+            step_time: Time the stage took in seconds
+            message: Status message to show when the stage succeeded
+            
+        Returns:
+            True if the pipeline should continue with the next stage
+        """
+        if not result['success']:
+            self.failed_step = step
+            self.error = f"{STEP_NAMES[step]} failed: {result['error']}"
+            return False
+        self.step_times[STEP_NAMES[step]] = step_time
+        self.completed_steps.append(step)
+        self.messages.append(message)
+        return not self.cancel_event.is_set()
+
+def run_pipeline(job):
+    """Run all four pipeline stages for a job on a worker thread"""
+    try:
+        progress_data = {
+            'detection_time': 0,
+            'extraction_time': 0,
+            'validation_time': 0,
+            'mapping_time': 0
+        }
+        
+        # Step 1: Detection
+        detection_result, progress_data['detection_time'] = run_timed(run_dcne_detection, job.image_path, job.temp_dir)
+        if not job.record_step(0, detection_result, progress_data['detection_time'],
+                               f"Detection Complete ({progress_data['detection_time']:.1f}s)"):
+            return None
+        
+        # Step 2: Extraction
+        # Crops are cut from the detector's predictions, so the image is sent to Custom Vision once
+        extraction_result, progress_data['extraction_time'] = run_timed(
+            run_hexagon_extraction, job.image_path, job.temp_dir, job.image_data, detection_result.get('predictions')
+        )
+        if not job.record_step(1, extraction_result, progress_data['extraction_time'],
+                               f"Extraction Complete ({extraction_result.get('hexagon_count', 0)} hexagons, "
+                               f"{progress_data['extraction_time']:.1f}s)"):
+            return None
+        
+        # Step 3: Validation
+        validation_result, progress_data['validation_time'] = run_timed(
+            run_hexagon_validation, extraction_result['hexagons_folder'], job.temp_dir
+        )
+        if not job.record_step(2, validation_result, progress_data['validation_time'],
+                               f"Validation Complete ({validation_result.get('true_count', 0)} true hexagons, "
+                               f"{progress_data['validation_time']:.1f}s)"):
+            return None
+        
+        # Step 4: Mapping
+        # Without debug artifacts, write the final image straight into the results cache entry
+        # instead of the job folder, so caching the results needs no copy
+        mapping_dir = None if DEBUG_ARTIFACTS else os.path.join(get_results_cache_dir(), job.upload_hash)
+        mapping_result, progress_data['mapping_time'] = run_timed(
+            run_enhanced_mapping,
+            job.image_path,
+            validation_result['true_hexagons_json'],
+            detection_result['detection_json'],
+            job.temp_dir,
+            validation_result.get('true_hexagons'),
+            detection_result.get('predictions'),
+            mapping_dir
+        )
+        if not job.record_step(3, mapping_result, progress_data['mapping_time'],
+                               f"Mapping Complete ({progress_data['mapping_time']:.1f}s)"):
+            return None
+        
+        results = {
+            'detection_result': detection_result,
+            'extraction_result': extraction_result,
+            'validation_result': validation_result,
+            'mapping_result': mapping_result,
+            'progress_data': progress_data,
+            'temp_dir': job.temp_dir,
+            # Counted once here so result reruns don't list the folder again
+            'temp_file_count': count_directory_entries(job.temp_dir) if DEBUG_ARTIFACTS else None
+        }
+        # Cache before the job folder goes away, so the results point at the cached image
+        job.results = save_cached_results(job.upload_hash, results) or results
+        return job.results
+        
+    except Exception as e:
+        job.error = f"Exception occurred: {str(e)}"
+        return None
+    finally:
+        # The job folder only holds intermediate files once the run has ended, whether it
+        # succeeded, failed or was stopped; keep it for inspection when debugging
+        if not DEBUG_ARTIFACTS:
+            shutil.rmtree(job.temp_dir, ignore_errors=True)
+
+@functools.lru_cache(maxsize=64)
+def format_completed_steps(completed_steps, step_times):
+    """
+    Build the sidebar summary of finished pipeline stages
+    
+    Args:
+        completed_steps: Frozen set of completed stage indices
+        step_times: Tuple of (stage name, seconds) pairs
+        
+    Returns:
+        Markdown with one line per completed stage, or an empty string
+    """
+    times = dict(step_times)
+    lines = []
+    for i, step in enumerate(STEP_NAMES):
+        if i in completed_steps:
+            if step in times:
+                lines.append(f"{step} ({times[step]:.1f}s)")
+            else:
+                lines.append(f"{step} ✓")
+    return "  \n".join(lines)
+
+INSTANCE_PAGE_SIZE = 50  # instance analysis entries rendered per page
+INSTANCE_ITEM_TEMPLATE = '<div class="duplicate-item{cls}"><strong>{key}</strong>: {count} instance{suffix}</div>'
+
+@functools.lru_cache(maxsize=32)
+def format_instances_html(instance_counts):
+    """
+    Build the instance analysis list shown with the results
+    
+    Args:
+        instance_counts: Tuple of (instance key, count) pairs
+        
+    Returns:
+        HTML with one item per instance; unique instances get the green "unique" style
+    """
+    # Multiple instances show as duplicates, a single instance as unique
+    return "".join(
+        INSTANCE_ITEM_TEMPLATE.format(cls="" if count > 1 else " unique", key=key, count=count,
+                                      suffix="s" if count > 1 else " (unique)")
+        for key, count in instance_counts
+    )
+
+def build_results_summary(results):
+    """
+    Derive the values shown in the results view from the pipeline results
+    
+    Args:
+        results: Pipeline results dictionary
+        
+    Returns:
+        Dictionary with the true hexagon count, total processing time and the (key, count)
+        pairs of the instance analysis (None if the mapping produced no analysis)
+    """
+    instance_counts = None
+    duplicate_analysis = results['mapping_result'].get('duplicate_analysis')
+    if duplicate_analysis:
+        # Show all instances including unique ones; fall back to duplicates if all_instances is not available
+        instances = duplicate_analysis.get('all_instances') or duplicate_analysis.get('duplicates', {})
+        instance_counts = tuple((key, info.get('count', 1)) for key, info in instances.items())
+    
+    return {
+        'true_count': results['validation_result']['true_count'],
+        'total_time': sum(results['progress_data'].values()),
+        'instance_counts': instance_counts
+    }
+
+# Run the instance list as a fragment where supported, so paging reruns only the list
+_fragment = getattr(st, 'fragment', None) or (lambda func: func)
+
+@_fragment
+def render_instance_analysis(instance_counts):
+    """Render the instance analysis list, one page at a time for large results"""
+    if not instance_counts:
+        st.info("No instances found!")
+        return
+    
+    # Large drawings can have hundreds of keys; only render one page of them at a time
+    page_count = -(-len(instance_counts) // INSTANCE_PAGE_SIZE)
+    if page_count > 1:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count,
+                               value=1, step=1, key="instance_page")
+        start = (page - 1) * INSTANCE_PAGE_SIZE
+        instance_counts = instance_counts[start:start + INSTANCE_PAGE_SIZE]
+    # Render every instance as one markdown block, built once per distinct page
+    st.markdown(format_instances_html(instance_counts), unsafe_allow_html=True)
+
+def cancel_pipeline_job():
+    """Signal the running job, if any, to stop after its current stage"""
+    job = st.session_state.get('pipeline_job')
+    if job is not None:
+        job.cancel_event.set()
+    st.session_state.pipeline_job = None
+
+def store_processing_results(results):
+    """Keep a result set in session state under a new run number for the results view"""
+    st.session_state['processing_results'] = results
+    st.session_state['results_run'] = st.session_state.get('results_run', 0) + 1
+
+def finish_pipeline_job(job):
+    """Move a finished job's outcome into session state"""
+    st.session_state.pipeline_job = None
+    evict_prediction_cache()
+    
+    # Mirror the job's progress into session state for the sidebar
+    st.session_state.completed_steps = set(job.completed_steps)
+    st.session_state['processing_status'] = {
+        step: {'completed': True, 'time': step_time} for step, step_time in job.step_times.items()
+    }
+    
+    if job.results is not None:
+        # Mark processing as completed
+        st.session_state.processing_completed = True
+        st.session_state.processing_started = False
+        
+        # Show completion message in sidebar
+        st.success("✅ Processing completed successfully!")
+        
+        # Store results in session state for display
+        store_processing_results(job.results)
+    else:
+        if job.error:
+            st.error(job.error)
+        if job.failed_step == 0:
+            st.info("Debug info: Check if config.json exists and has valid API keys")
+        # Reset processing state on error or stop
+        st.session_state.processing_started = False
+        st.session_state.processing_completed = False
+        st.session_state.processing_halted = True
+
+def poll_pipeline_job(rerun_until_done=False):
+    """
+    Show the running job's progress once, and rerun the app when it has finished
+    
+    Args:
+        rerun_until_done: Schedule the next check with a full rerun (used when fragments are unavailable)
+    """
+    job = st.session_state.get('pipeline_job')
+    if job is None:
+        return
+    
+    messages = list(job.messages)
+    if messages:
+        st.success("  \n".join(messages))
+    else:
+        st.info("Starting pipeline...")
+    
+    if not job.future.done():
+        if rerun_until_done:
+            time.sleep(PIPELINE_POLL_INTERVAL)
+            st.rerun()
+        return
+    
+    finish_pipeline_job(job)
+    st.rerun()
+
+# Where fragments exist, the progress check reruns on its own timer without rerunning the whole app
+POLL_PIPELINE_FRAGMENT = (st.fragment(run_every=PIPELINE_POLL_INTERVAL)(poll_pipeline_job)
+                          if hasattr(st, 'fragment') else None)
+
 def main():
+    # Clean up folders left behind by earlier runs and redeploys
+    sweep_stale_temp_directories()
+    
     # Main header
     st.markdown('<h1 class="main-header">DCNE Demo</h1>', unsafe_allow_html=True)
     
@@ -441,18 +976,12 @@ def main():
     if st.session_state.get('processing_started', False) or st.session_state.get('processing_completed', False) or st.session_state.get('processing_halted', False):
         st.sidebar.markdown("### Processing Pipeline")
         
-        # Define step names
-        step_names = ["Detection", "Extraction", "Validation", "Mapping"]
-        
-        # Show only completed steps
-        for i, step in enumerate(step_names):
-            if i in st.session_state.get('completed_steps', []):
-                # Step is completed
-                if 'processing_status' in st.session_state and step in st.session_state['processing_status']:
-                    time_taken = st.session_state['processing_status'][step].get('time', 0)
-                    st.sidebar.success(f"{step} ({time_taken:.1f}s)")
-                else:
-                    st.sidebar.success(f"{step} ✓")
+        # Show only completed steps, as one element rebuilt only when the step state changes
+        processing_status = st.session_state.get('processing_status', {})
+        step_times = tuple((step, status.get('time', 0)) for step, status in processing_status.items())
+        completed_summary = format_completed_steps(frozenset(st.session_state.get('completed_steps', ())), step_times)
+        if completed_summary:
+            st.sidebar.success(completed_summary)
         
         # Show processing status
         if st.session_state.get('processing_started', False) and not st.session_state.get('processing_completed', False):
@@ -465,20 +994,26 @@ def main():
     st.markdown("### Upload Image")
     uploaded_file = st.file_uploader(
         "Choose an image file",
-        type=['jpg', 'jpeg', 'png', 'bmp', 'tiff'],
+        type=UPLOAD_TYPES,
         help="Upload an image containing hexagons to process",
         key="file_uploader"
     )
     st.markdown('</div>', unsafe_allow_html=True)
     
     if uploaded_file is not None:
+        # Identify the upload by content so re-uploads of the same image are recognized
+        # Read the upload once; the same bytes feed the hash, the preview, the temp file and extraction
+        upload_data = uploaded_file.getvalue()
+        upload_hash = hash_upload(upload_data)
+        
         # Reset processing state when a new file is uploaded
-        if 'previous_file_name' not in st.session_state or st.session_state.previous_file_name != uploaded_file.name:
+        if st.session_state.get('previous_file_hash') != upload_hash:
             # Reset all processing state
+            cancel_pipeline_job()
             st.session_state.processing_started = False
             st.session_state.processing_completed = False
             st.session_state.processing_halted = False
-            st.session_state.completed_steps = []
+            st.session_state.completed_steps = set()
             st.session_state.processing_status = {}
             st.session_state.processing_results = {}
             st.session_state.detection_result = None
@@ -486,8 +1021,9 @@ def main():
             st.session_state.validation_result = None
             st.session_state.mapping_result = None
             
-            # Store the new file name
+            # Store the new file name and hash
             st.session_state.previous_file_name = uploaded_file.name
+            st.session_state.previous_file_hash = upload_hash
             
             # Force rerun to clear the display
             st.rerun()
@@ -497,7 +1033,7 @@ def main():
         
         with col1:
             st.markdown("### Uploaded Image")
-            image = Image.open(uploaded_file)
+            image = open_uploaded_image(upload_hash, upload_data)
             st.image(image, caption="Original Image", use_container_width=True)
         
         with col2:
@@ -521,7 +1057,7 @@ def main():
             st.session_state.current_step = 0  # 0=Detection, 1=Extraction, 2=Validation, 3=Mapping
             
         if 'completed_steps' not in st.session_state:
-            st.session_state.completed_steps = []
+            st.session_state.completed_steps = set()
         
         # Show button only if not processing, not completed, and not halted
         if not st.session_state.processing_started and not st.session_state.processing_completed and not st.session_state.processing_halted:
@@ -542,19 +1078,12 @@ def main():
             
             # Stop processing button below
             if st.button("⏹️ Stop Processing", type="secondary", use_container_width=True):
+                cancel_pipeline_job()
                 st.session_state.processing_started = False
                 st.session_state.processing_completed = False
                 st.session_state.processing_halted = True
                 st.rerun()
             
-            # Initialize progress tracking
-            progress_data = {
-                'detection_time': 0,
-                'extraction_time': 0,
-                'validation_time': 0,
-                'mapping_time': 0
-            }
-            
             # Initialize processing status if not exists
             if 'processing_status' not in st.session_state:
                 st.session_state['processing_status'] = {
@@ -564,184 +1093,46 @@ def main():
                     'Mapping': {'completed': False, 'time': 0}
                 }
             
-            # Create temporary directory
-            temp_dir = create_temp_directory()
-            
-            # Save uploaded file
-            temp_image_path = os.path.join(temp_dir, uploaded_file.name)
-            with open(temp_image_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            # Check if processing was stopped
-            if not st.session_state.processing_started:
-                st.session_state.processing_halted = True
-                st.warning("Processing was stopped")
+            # Reuse the results if this exact image was processed before
+            job = st.session_state.get('pipeline_job')
+            cached_results = load_cached_results(upload_hash) if job is None else None
+            if cached_results is not None:
+                step_times = {
+                    'Detection': cached_results['progress_data']['detection_time'],
+                    'Extraction': cached_results['progress_data']['extraction_time'],
+                    'Validation': cached_results['progress_data']['validation_time'],
+                    'Mapping': cached_results['progress_data']['mapping_time']
+                }
+                st.session_state['processing_status'] = {
+                    step: {'completed': True, 'time': step_time} for step, step_time in step_times.items()
+                }
+                st.session_state.completed_steps = set(range(len(STEP_NAMES)))
+                store_processing_results(cached_results)
+                st.session_state.processing_completed = True
+                st.session_state.processing_started = False
                 st.rerun()
             
-            # Run all processing steps automatically
-            with st.sidebar:
-                # Step 1: Detection
-                if 0 not in st.session_state.completed_steps:
-                    with st.spinner("Making image high resolution and detecting hexagons..."):
-                        start_time = time.time()
-                        detection_result = run_dcne_detection(temp_image_path, temp_dir)
-                        progress_data['detection_time'] = time.time() - start_time
-                        
-                        # Check if processing was stopped
-                        if not st.session_state.processing_started:
-                            st.session_state.processing_halted = True
-                            st.warning("Processing was stopped during detection")
-                            st.rerun()
-                        
-                        if detection_result['success']:
-                            # Store detection_result in session state for persistence
-                            st.session_state['detection_result'] = detection_result
-                            st.session_state['processing_status']['Detection'] = {
-                                'completed': True, 
-                                'time': progress_data['detection_time']
-                            }
-                            st.session_state.completed_steps.append(0)
-                            st.success(f"Detection Complete ({progress_data['detection_time']:.1f}s)")
-                        else:
-                            st.error(f"Detection failed: {detection_result['error']}")
-                            st.info("Debug info: Check if config.json exists and has valid API keys")
-                            # Reset processing state on error
-                            st.session_state.processing_started = False
-                            st.session_state.processing_completed = False
-                            st.session_state.processing_halted = True
-                            st.rerun()
+            if job is None:
+                # Create temporary directory
+                temp_dir = create_temp_directory(upload_hash)
                 
-                # Step 2: Extraction
-                if 0 in st.session_state.completed_steps and 1 not in st.session_state.completed_steps:
-                    with st.spinner("Extracting individual hexagons..."):
-                        start_time = time.time()
-                        extraction_result = run_hexagon_extraction(temp_image_path, temp_dir)
-                        progress_data['extraction_time'] = time.time() - start_time
-                        
-                        # Check if processing was stopped
-                        if not st.session_state.processing_started:
-                            st.session_state.processing_halted = True
-                            st.warning("Processing was stopped during extraction")
-                            st.rerun()
-                        
-                        if extraction_result['success']:
-                            # Store extraction_result in session state for persistence
-                            st.session_state['extraction_result'] = extraction_result
-                            st.session_state['processing_status']['Extraction'] = {
-                                'completed': True, 
-                                'time': progress_data['extraction_time']
-                            }
-                            st.session_state.completed_steps.append(1)
-                            st.success(f"Extraction Complete ({extraction_result['hexagon_count']} hexagons, {progress_data['extraction_time']:.1f}s)")
-                        else:
-                            st.error(f"Extraction failed: {extraction_result['error']}")
-                            # Reset processing state on error
-                            st.session_state.processing_started = False
-                            st.session_state.processing_completed = False
-                            st.session_state.processing_halted = True
-                            st.rerun()
+                # Save uploaded file
+                temp_image_path = os.path.join(temp_dir, uploaded_file.name)
+                with open(temp_image_path, "wb") as f:
+                    f.write(upload_data)
                 
-                # Step 3: Validation
-                if 1 in st.session_state.completed_steps and 2 not in st.session_state.completed_steps:
-                    # Safety check for extraction_result from session state
-                    if 'extraction_result' not in st.session_state or st.session_state.extraction_result is None:
-                        st.error("Extraction result not available. Please restart processing.")
-                        st.session_state.processing_started = False
-                        st.session_state.processing_completed = False
-                        st.session_state.processing_halted = True
-                        st.rerun()
-                    
-                    with st.spinner("Validating hexagons with GPT-4..."):
-                        start_time = time.time()
-                        validation_result = run_hexagon_validation(st.session_state.extraction_result['hexagons_folder'], temp_dir)
-                        progress_data['validation_time'] = time.time() - start_time
-                        
-                        # Check if processing was stopped
-                        if not st.session_state.processing_started:
-                            st.session_state.processing_halted = True
-                            st.warning("Processing was stopped during validation")
-                            st.rerun()
-                        
-                        if validation_result['success']:
-                            # Store validation_result in session state for persistence
-                            st.session_state['validation_result'] = validation_result
-                            st.session_state['processing_status']['Validation'] = {
-                                'completed': True, 
-                                'time': progress_data['validation_time']
-                            }
-                            st.session_state.completed_steps.append(2)
-                            st.success(f"Validation Complete ({validation_result['true_count']} true hexagons, {progress_data['validation_time']:.1f}s)")
-                        else:
-                            st.error(f"Validation failed: {validation_result['error']}")
-                            # Reset processing state on error
-                            st.session_state.processing_started = False
-                            st.session_state.processing_completed = False
-                            st.session_state.processing_halted = True
-                            st.rerun()
-                
-                # Step 4: Mapping
-                if 2 in st.session_state.completed_steps and 3 not in st.session_state.completed_steps:
-                    # Safety check for required variables from session state
-                    if 'validation_result' not in st.session_state or st.session_state.validation_result is None or 'detection_result' not in st.session_state or st.session_state.detection_result is None:
-                        st.error("Required results not available. Please restart processing.")
-                        st.session_state.processing_started = False
-                        st.session_state.processing_completed = False
-                        st.session_state.processing_halted = True
-                        st.rerun()
-                        
-                    with st.spinner("Mapping and counting duplicates..."):
-                        start_time = time.time()
-                        mapping_result = run_enhanced_mapping(
-                            temp_image_path,
-                            st.session_state.validation_result['true_hexagons_json'],
-                            st.session_state.detection_result['detection_json'],
-                            temp_dir
-                        )
-                        progress_data['mapping_time'] = time.time() - start_time
-                        
-                        # Check if processing was stopped
-                        if not st.session_state.processing_started:
-                            st.session_state.processing_halted = True
-                            st.warning("Processing was stopped during mapping")
-                            st.rerun()
-                        
-                        if mapping_result['success']:
-                            # Store mapping_result in session state for persistence
-                            st.session_state['mapping_result'] = mapping_result
-                            st.session_state['processing_status']['Mapping'] = {
-                                'completed': True, 
-                                'time': progress_data['mapping_time']
-                            }
-                            st.session_state.completed_steps.append(3)
-                            st.success(f"Mapping Complete ({progress_data['mapping_time']:.1f}s)")
-                        else:
-                            st.error(f"Mapping failed: {mapping_result['error']}")
-                            # Reset processing state on error
-                            st.session_state.processing_started = False
-                            st.session_state.processing_completed = False
-                            st.session_state.processing_halted = True
-                            st.rerun()
+                # Queue the pipeline; this script run only polls its progress
+                job = PipelineJob(upload_hash, temp_image_path, upload_data, temp_dir)
+                job.future = get_pipeline_executor().submit(run_pipeline, job)
+                st.session_state.pipeline_job = job
             
-            # Check if all steps are completed
-            if len(st.session_state.completed_steps) == 4:
-                # Mark processing as completed
-                st.session_state.processing_completed = True
-                st.session_state.processing_started = False
-                
-                # Show completion message in sidebar
-                st.sidebar.success("✅ Processing completed successfully!")
-                
-                # Store results in session state for display
-                st.session_state['processing_results'] = {
-                    'detection_result': detection_result,
-                    'extraction_result': extraction_result,
-                    'validation_result': validation_result,
-                    'mapping_result': mapping_result,
-                    'progress_data': progress_data,
-                    'temp_dir': temp_dir
-                }
-                
-                st.rerun()
+            # Check on the job without holding this script run; the pipeline keeps running on
+            # the worker pool and the check repeats until the job finishes
+            with st.sidebar:
+                if POLL_PIPELINE_FRAGMENT is not None:
+                    POLL_PIPELINE_FRAGMENT()
+                else:
+                    poll_pipeline_job(rerun_until_done=True)
         
         # Show halted state when processing was stopped
         elif st.session_state.processing_halted:
@@ -763,6 +1154,16 @@ def main():
         elif st.session_state.processing_completed and 'processing_results' in st.session_state:
             results = st.session_state['processing_results']
             
+            # Values derived from the results are computed once per result set and reused on
+            # reruns; Streamlit drops elements a run does not emit, so the widgets are still drawn
+            # (every stored result set gets a new run number, see store_processing_results)
+            results_run = st.session_state.get('results_run')
+            summary = st.session_state.get('results_summary')
+            if summary is None or summary['run'] != results_run:
+                summary = build_results_summary(results)
+                summary['run'] = results_run
+                st.session_state['results_summary'] = summary
+            
             # Results section
             st.markdown("### Results Summary")
             
@@ -772,65 +1173,62 @@ def main():
             with col1:
                 st.markdown(f'''
                 <div class="metric-card">
-                    <div class="metric-value">{results['validation_result']['true_count']}</div>
+                    <div class="metric-value">{summary['true_count']}</div>
                     <div class="metric-label">True Hexagons</div>
                 </div>
                 ''', unsafe_allow_html=True)
             
             with col2:
-                total_time = sum(results['progress_data'].values())
                 st.markdown(f'''
                 <div class="metric-card">
-                    <div class="metric-value">{total_time:.1f}s</div>
+                    <div class="metric-value">{summary['total_time']:.1f}s</div>
                     <div class="metric-label">Processing Time</div>
                 </div>
                 ''', unsafe_allow_html=True)
             
             # Duplicate analysis - show all instances including unique ones
-            if results['mapping_result'].get('duplicate_analysis'):
+            if summary['instance_counts'] is not None:
                 st.markdown("### Instance Analysis")
-                duplicates = results['mapping_result']['duplicate_analysis'].get('duplicates', {})
-                all_instances = results['mapping_result']['duplicate_analysis'].get('all_instances', {})
-                
-                if all_instances:
-                    for key, info in all_instances.items():
-                        count = info.get('count', 1)
-                        if count > 1:
-                            # Multiple instances - show as duplicate
-                            st.markdown(f'''
-                            <div class="duplicate-item">
-                                <strong>{key}</strong>: {count} instances
-                            </div>
-                            ''', unsafe_allow_html=True)
-                        else:
-                            # Single instance - show as unique
-                            st.markdown(f'''
-                            <div class="duplicate-item" style="background-color: #d4edda; border-color: #c3e6cb;">
-                                <strong>{key}</strong>: {count} instance (unique)
-                            </div>
-                            ''', unsafe_allow_html=True)
-                elif duplicates:
-                    # Fallback to duplicates if all_instances not available
-                    for key, info in duplicates.items():
-                        st.markdown(f'''
-                        <div class="duplicate-item">
-                            <strong>{key}</strong>: {info['count']} instances
-                        </div>
-                        ''', unsafe_allow_html=True)
-                else:
-                    st.info("No instances found!")
+                render_instance_analysis(summary['instance_counts'])
             
-            # Display final mapped image
-            if results['mapping_result']['success'] and os.path.exists(results['mapping_result']['mapped_image']):
+            # Display final mapped image; one stat covers both the existence check and the cache key
+            mapped_image = results['mapping_result'].get('mapped_image')
+            try:
+                mapped_stat = os.stat(mapped_image) if mapped_image else None
+            except FileNotFoundError:
+                mapped_stat = None
+            if results['mapping_result']['success'] and mapped_stat:
                 st.markdown("### Final Result")
-                final_image = Image.open(results['mapping_result']['mapped_image'])
-                st.image(final_image, caption="Mapped True Hexagons", use_container_width=True)
+                display_image = load_display_image_cached(mapped_image, mapped_stat.st_mtime_ns)
+                image_url = publish_static_image(display_image, get_static_image_name(upload_hash),
+                                                 mapped_stat.st_mtime_ns)
+                if image_url:
+                    # The browser fetches (and caches) the image itself, decoding it only when scrolled into view
+                    st.markdown(f'''
+                    <figure style="margin: 0;">
+                        <img src="{image_url}" alt="Mapped True Hexagons" loading="lazy" decoding="async" fetchpriority="low" style="width: 100%;">
+                        <figcaption style="text-align: center; color: #666; font-size: 0.9rem;">Mapped True Hexagons</figcaption>
+                    </figure>
+                    ''', unsafe_allow_html=True)
+                else:
+                    st.image(display_image, caption="Mapped True Hexagons", use_container_width=True)
+                
+                st.download_button(
+                    "Download full resolution",
+                    data=load_image_bytes_cached(mapped_image, mapped_stat.st_mtime_ns),
+                    file_name=os.path.basename(mapped_image),
+                    mime="image/jpeg"
+                )
             
             # Store temp directory info for debug tab
-            st.session_state['temp_dir_info'] = {
-                'temp_dir': results['temp_dir'],
-                'file_count': len(os.listdir(results['temp_dir'])) if os.path.exists(results['temp_dir']) else 0
-            }
+            if DEBUG_ARTIFACTS:
+                file_count = results.get('temp_file_count')
+                if file_count is None:
+                    file_count = count_directory_entries(results['temp_dir'])
+                st.session_state['temp_dir_info'] = {
+                    'temp_dir': results['temp_dir'],
+                    'file_count': file_count
+                }
 
 if __name__ == "__main__":
     main()
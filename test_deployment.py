@@ -3,8 +3,15 @@ import tempfile
 import uuid
 from pathlib import Path
 
-def test_deployment_config():
-    """Test deployment configuration and show file storage locations"""
+from deployment_config import resolve_dirs
+
+def probe_deployment_config():
+    """
+    Show the file storage locations for the current environment and write a test file to each
+    
+    Returns:
+        Tuple of (temporary test file, output test file)
+    """
     
     print("🔧 Testing Deployment Configuration")
     print("=" * 50)
@@ -18,38 +25,24 @@ def test_deployment_config():
     print(f"   STORAGE_TYPE: {storage_type}")
     print()
     
-    # Test temp directory creation
-    session_id = f"hexagon_detection_{uuid.uuid4().hex[:8]}"
+    # Test temp directory creation; export HEXAGON_SESSION_ID so repeated probes reuse the
+    # same directories instead of leaving a new set behind each run
+    session_id = os.environ.get('HEXAGON_SESSION_ID') or f"hexagon_detection_{uuid.uuid4().hex[:8]}"
     
-    if deployment_mode == 'production':
-        if storage_type == 'local':
-            temp_dir = os.path.join(tempfile.gettempdir(), "hexagon_detection", session_id)
-        elif storage_type == 'shared':
-            temp_dir = os.path.join("/shared/uploads", "hexagon_detection", session_id)
-        else:
-            temp_dir = os.path.join(tempfile.gettempdir(), "hexagon_detection", session_id)
-    else:
-        temp_dir = os.path.join(os.getcwd(), "temp-directory", session_id)
+    # Resolve both locations with the same helper the app uses
+    image_name = "test_image"
+    temp_dir, output_dir = resolve_dirs(session_id, image_name, deployment_mode, storage_type)
     
-    # Create directory
-    os.makedirs(temp_dir, exist_ok=True)
+    # Create directory (repeat probes reuse the session directory, so check before creating)
+    if not os.path.isdir(temp_dir):
+        os.makedirs(temp_dir, exist_ok=True)
     
     print(f"📁 File Storage Locations:")
     print(f"   Temporary Directory: {temp_dir}")
     
     # Test output directory
-    image_name = "test_image"
-    if deployment_mode == 'production':
-        if storage_type == 'local':
-            output_dir = os.path.join(tempfile.gettempdir(), "hexagon_output", session_id, image_name)
-        elif storage_type == 'shared':
-            output_dir = os.path.join("/shared/results", "hexagon_output", session_id, image_name)
-        else:
-            output_dir = os.path.join(tempfile.gettempdir(), "hexagon_output", session_id, image_name)
-    else:
-        output_dir = os.path.join("output", image_name)
-    
-    os.makedirs(output_dir, exist_ok=True)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
     print(f"   Output Directory: {output_dir}")
     print()
     
@@ -57,11 +50,14 @@ def test_deployment_config():
     test_temp_file = os.path.join(temp_dir, "test_temp.txt")
     test_output_file = os.path.join(output_dir, "test_output.txt")
     
-    with open(test_temp_file, 'w') as f:
-        f.write("Test temporary file")
+    # Files left by an earlier probe in the same session already prove the locations are writable
+    if not os.path.exists(test_temp_file):
+        with open(test_temp_file, 'w') as f:
+            f.write("Test temporary file")
     
-    with open(test_output_file, 'w') as f:
-        f.write("Test output file")
+    if not os.path.exists(test_output_file):
+        with open(test_output_file, 'w') as f:
+            f.write("Test output file")
     
     print(f"✅ Test Files Created:")
     print(f"   Temp file: {test_temp_file}")
@@ -87,6 +83,23 @@ def test_deployment_config():
     
     print()
     print("🎯 Test completed! Check the directories above to see the test files.")
+    return test_temp_file, test_output_file
+
+def test_deployment_config(tmp_path, monkeypatch):
+    """Test deployment configuration in a scratch working directory"""
+    # Development mode resolves both locations under the working directory, so the test
+    # files end up in tmp_path and are removed with it
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DEPLOYMENT_MODE', 'development')
+    monkeypatch.setenv('STORAGE_TYPE', 'local')
+    monkeypatch.setenv('HEXAGON_SESSION_ID', 'hexagon_detection_test')
+    
+    test_temp_file, test_output_file = probe_deployment_config()
+    
+    assert Path(test_temp_file).resolve() == tmp_path / "temp-directory" / "hexagon_detection_test" / "test_temp.txt"
+    assert Path(test_output_file).resolve() == tmp_path / "output" / "test_image" / "test_output.txt"
+    assert os.path.isfile(test_temp_file)
+    assert os.path.isfile(test_output_file)
 
 if __name__ == "__main__":
-    test_deployment_config()
+    probe_deployment_config()